@@ -1,7 +1,94 @@
+import asyncio
+import contextlib
+import copy
+import hashlib
 import together
 import os
-import json
-from .prompts import COMMAND_CLASSIFIER_PROMPT, MASTER_ROUTER_PROMPT, SUMMARIZER_PROMPT, QUESTION_ANSWERER_PROMPT
+import orjson
+import re
+import weakref
+from collections import OrderedDict
+from .history import SessionHistory, Turn
+from .prompts import (MASTER_ROUTER_SYSTEM_PROMPT, render_master_router, render_summarizer,
+                      render_question_answerer)
+from .utils import GmailQueryFastPath
+
+DEFAULT_SYSTEM_PROMPT = "You are a helpful AI assistant that responds with valid JSON objects for Gmail operations."
+
+# Prompt renderer, max_tokens, temperature and response_type for each follow-up action
+FOLLOW_UP_ACTIONS = {
+    "SUMMARIZE_CONTENT": (render_summarizer, 1500, 0.3, "summary"),
+    "ANSWER_QUESTION": (render_question_answerer, 1000, 0.2, "answer"),
+}
+
+# Markdown code fence wrapped around a JSON reply, stripped in a single pass
+_FENCE_RE = re.compile(r"\A\s*```(?:json)?\s*|\s*```\s*\Z")
+
+# --- Local fast-path router ---
+# Plain searches, optionally prefixed with "summarize", are routed without calling
+# the LLM; GmailQueryFastPath (shared with caira_engine) builds their query.
+_SUMMARIZE_RE = re.compile(r"summari[sz]e\b", re.IGNORECASE)
+
+
+def _fast_route(command_text: str) -> dict | None:
+    """Returns the router decision for a trivially classifiable command, or None."""
+    command = command_text.strip()
+    summarize = _SUMMARIZE_RE.match(command)
+    search_query = GmailQueryFastPath.build(command[summarize.end():] if summarize else command)
+    if search_query is None:
+        return None
+
+    description = f"emails matching {search_query}"
+    if not summarize:
+        return {
+            "action_type": "GMAIL_QUERY_GENERATED",
+            "payload": {"search_query": search_query, "query_description": description}
+        }
+    return {
+        "action_type": "FETCH_AND_SUMMARIZE",
+        "payload": {
+            "search_query": search_query,
+            "query_description": description,
+            "processing_instruction": f"Summarize the {description}"
+        }
+    }
+
+
+# Together AI clients shared by every engine instance in the process, keyed by API key
+_CLIENTS: dict[str, together.AsyncTogether] = {}
+
+
+def _get_client(api_key: str) -> together.AsyncTogether:
+    """Returns the process-wide Together AI client for an API key."""
+    client = _CLIENTS.get(api_key)
+    if client is None:
+        client = _CLIENTS[api_key] = together.AsyncTogether(api_key=api_key)
+    return client
+
+
+# Email fields the follow-up prompts need; anything else is dropped before prompting
+EMAIL_PROMPT_FIELDS = ("from", "sender", "to", "subject", "date", "timestamp", "snippet")
+
+
+def _project_emails(email_data: list, max_body_chars: int = 800, max_emails: int = 50) -> list:
+    """Keeps the prompt-relevant fields of each email and truncates its body to bound prompt tokens."""
+    projected = []
+    for email in email_data[:max_emails]:
+        fields = {key: email[key] for key in EMAIL_PROMPT_FIELDS if key in email}
+        body = email.get("body")
+        if isinstance(body, str):
+            fields["body"] = body[:max_body_chars]
+        projected.append(fields)
+    return projected
+
+
+def _dumps(obj) -> str:
+    """Serializes obj to a JSON string."""
+    return orjson.dumps(obj).decode()
+
+
+MAX_SESSIONS = 10_000  # Least recently used sessions are evicted beyond this
+ROUTER_CACHE_SIZE = 1024  # Router decisions kept for repeated (command, history, context) inputs
 
 
 class CairaAI_Engine:
@@ -11,43 +98,105 @@ class CairaAI_Engine:
         if not api_key:
             raise ValueError("TOGETHER_API_KEY environment variable is required")
 
-        self.client = together.Together(api_key=api_key)
+        self.client = _get_client(api_key)
         self.model = os.environ.get("TOGETHER_MODEL", "mistralai/Mistral-7B-Instruct-v0.1")
-        self.conversations = {}  # In-memory history storage
+        # Opt-in: route trivially classifiable commands locally instead of calling the LLM
+        self.fast_routing = os.environ.get("CAIRA_FAST_ROUTING", "false").lower() == "true"
+        # In-memory history storage, ordered from least to most recently used session
+        self.conversations: OrderedDict[str, SessionHistory] = OrderedDict()
+        self._max_sessions = MAX_SESSIONS
+        # Opt-in cap on in-flight router calls, e.g. to stay under a provider rate limit; 0 means unlimited
+        max_router_calls = int(os.environ.get("CAIRA_ROUTER_MAX_CONCURRENCY", "0"))
+        self._router_limit = asyncio.Semaphore(max_router_calls) if max_router_calls > 0 else contextlib.nullcontext()
+        # Router decisions keyed by a digest of the router inputs, least recently used first
+        self._router_cache: OrderedDict[bytes, dict] = OrderedDict()
+        # Per-session locks; entries disappear once no call holds or awaits them
+        self._locks: weakref.WeakValueDictionary[str, asyncio.Lock] = weakref.WeakValueDictionary()
         print(f"Unified CairaAI Engine Initialized with {self.model}")
 
     def _update_history(self, session_id: str, user_text: str, ai_response: dict):
         """Appends the latest turn to the conversation history."""
-        if session_id not in self.conversations:
-            self.conversations[session_id] = []
-
-        self.conversations[session_id].append({"user": user_text})
-        self.conversations[session_id].append({"ai": ai_response})
-
-        # Limit history size to prevent it from growing too large
-        if len(self.conversations[session_id]) > 12:
-            self.conversations[session_id] = self.conversations[session_id][-12:]
+        history = self.conversations.get(session_id)
+        if history is None:
+            if len(self.conversations) >= self._max_sessions:
+                self.conversations.popitem(last=False)
+            # Bounded by CAIRA_HISTORY_MAX; the router prompt is compacted separately
+            history = self.conversations[session_id] = SessionHistory()
+        self.conversations.move_to_end(session_id)
+
+        history.append(Turn("user", user_text), Turn("ai", ai_response))
+
+    def _lock(self, session_id: str) -> asyncio.Lock:
+        """Returns the lock serializing history-dependent calls for a session."""
+        lock = self._locks.get(session_id)
+        if lock is None:
+            lock = self._locks[session_id] = asyncio.Lock()
+        return lock
 
     def get_conversation_history(self, session_id: str) -> list:
         """Returns the conversation history for a given session."""
-        return self.conversations.get(session_id, [])
+        history = self.conversations.get(session_id)
+        return [turn.as_dict() for turn in history.turns()] if history else []
 
     def clear_conversation(self, session_id: str) -> bool:
         """Clears the conversation history for a given session."""
         if session_id in self.conversations:
+            # Cached router decisions stay: they are keyed on the history text, and are shared by other sessions
             del self.conversations[session_id]
             return True
         return False
 
-    def _call_together_ai(self, prompt: str, max_tokens: int = 1000, temperature: float = 0.1) -> str:
+    @staticmethod
+    def _router_cache_key(command_text: str, history_text: str, context_info: str) -> bytes:
+        """Digest of the normalized router inputs; blake2b is fast for cache keys."""
+        digest = hashlib.blake2b(digest_size=16)
+        for part in (command_text.lower().strip(), history_text, context_info):
+            digest.update(part.encode())
+            digest.update(b"\x1f")
+        return digest.digest()
+
+    async def _call_together_ai(self, prompt: str, max_tokens: int = 1000, temperature: float = 0.1,
+                                system_prompt: str = DEFAULT_SYSTEM_PROMPT, cache_system_prompt: bool = False) -> str:
         """Helper method to call Together AI with consistent parameters."""
+        system_message = {
+            "role": "system",
+            "content": system_prompt
+        }
+        if cache_system_prompt:
+            # Mark the static prefix as cacheable for backends that support prompt caching
+            system_message["cache_control"] = {"type": "ephemeral"}
+
         try:
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    system_message,
+                    {
+                        "role": "user",
+                        "content": prompt
+                    }
+                ],
+                max_tokens=max_tokens,
+                temperature=temperature,
+                top_p=0.9,
+                stop=None
+            )
+
+            return response.choices[0].message.content.strip()
+
+        except Exception as e:
+            raise Exception(f"Together AI API call failed: {str(e)}")
+
+    async def _stream_together_ai(self, prompt: str, max_tokens: int = 1000, temperature: float = 0.1,
+                                  system_prompt: str = DEFAULT_SYSTEM_PROMPT):
+        """Streams the completion text from Together AI as it is generated."""
+        try:
+            stream = await self.client.chat.completions.create(
                 model=self.model,
                 messages=[
                     {
                         "role": "system",
-                        "content": "You are a helpful AI assistant that responds with valid JSON objects for Gmail operations."
+                        "content": system_prompt
                     },
                     {
                         "role": "user",
@@ -57,46 +206,66 @@ class CairaAI_Engine:
                 max_tokens=max_tokens,
                 temperature=temperature,
                 top_p=0.9,
-                stop=None
+                stop=None,
+                stream=True
             )
 
-            return response.choices[0].message.content.strip()
+            async for chunk in stream:
+                delta = chunk.choices[0].delta if chunk.choices else None
+                if delta and delta.content:
+                    yield delta.content
 
         except Exception as e:
             raise Exception(f"Together AI API call failed: {str(e)}")
 
-    def process_initial_command(self, session_id: str, command_text: str, email_context: dict | None) -> dict:
+    async def process_initial_command(self, session_id: str, command_text: str, email_context: dict | None) -> dict:
         """Handles the FIRST call. It reads history and decides on a workflow."""
         print(f"Processing initial command for session: {session_id}")
 
-        # Retrieve history for the current session
-        history = self.conversations.get(session_id, [])
+        # Same-session commands run one at a time so each one sees the previous turn;
+        # different sessions still proceed concurrently.
+        async with self._lock(session_id):
+            return await self._route_command(session_id, command_text, email_context)
+
+    async def _route_command(self, session_id: str, command_text: str, email_context: dict | None) -> dict:
+        """Builds the router prompt from the session history and records the decision."""
+        if self.fast_routing:
+            ai_payload = _fast_route(command_text)
+            if ai_payload is not None:
+                self._update_history(session_id, command_text, ai_payload)
+                return ai_payload
 
-        # Format the history for the prompt
-        if history:
-            history_text = "\n".join([json.dumps(turn, indent=2) for turn in history])
-        else:
-            history_text = "No previous conversation history."
+        # Retrieve the pre-formatted history for the current session
+        history = self.conversations.get(session_id)
+        history_text = (history and history.prompt_text()) or "No previous conversation history."
 
         # Add email context to the prompt if it exists
         context_info = ""
         if email_context:
-            context_info = f"\n\n**Additional Context:**\n{json.dumps(email_context, indent=2)}"
+            context_info = f"\n\n**Additional Context:**\n{orjson.dumps(email_context).decode()}"
 
-        prompt = MASTER_ROUTER_PROMPT.format(
-            conversation_history=history_text,
-            user_command=command_text
-        ) + context_info
+        cache_key = self._router_cache_key(command_text, history_text, context_info)
+        cached_payload = self._router_cache.get(cache_key)
+        if cached_payload is not None:
+            self._router_cache.move_to_end(cache_key)
+            ai_payload = copy.deepcopy(cached_payload)
+            self._update_history(session_id, command_text, ai_payload)
+            return ai_payload
+
+        prompt = render_master_router(history_text, command_text) + context_info
 
         try:
             # Call Together AI to get the initial action_type
-            response_text = self._call_together_ai(prompt)
+            async with self._router_limit:
+                response_text = await self._call_together_ai(
+                    prompt, system_prompt=MASTER_ROUTER_SYSTEM_PROMPT, cache_system_prompt=True
+                )
 
             # Clean up the response (remove markdown code blocks if present)
-            cleaned_text = response_text.replace("\`\`\`json", "").replace("\`\`\`", "").strip()
+            cleaned_text = _FENCE_RE.sub("", response_text)
 
             # Parse the JSON response
-            ai_payload = json.loads(cleaned_text)
+            ai_payload = orjson.loads(cleaned_text)
 
             # Validate required fields
             if "action_type" not in ai_payload:
@@ -105,12 +274,16 @@ class CairaAI_Engine:
             if "payload" not in ai_payload:
                 ai_payload["payload"] = {}
 
+            self._router_cache[cache_key] = copy.deepcopy(ai_payload)
+            if len(self._router_cache) > ROUTER_CACHE_SIZE:
+                self._router_cache.popitem(last=False)
+
             # Update history with this turn
             self._update_history(session_id, command_text, ai_payload)
 
             return ai_payload
 
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             print(f"JSON parsing error: {e}")
             print(f"Raw response: {response_text if 'response_text' in locals() else 'No response'}")
             return {
@@ -121,56 +294,28 @@ class CairaAI_Engine:
             print(f"Error processing initial command: {e}")
             return {"error": f"Failed to process command: {str(e)}"}
 
-    def process_follow_up(self, session_id: str, follow_up_action: str, email_data: list,
-                          original_command: str) -> dict:
+    async def process_follow_up(self, session_id: str, follow_up_action: str, email_data: list,
+                                original_command: str) -> dict:
         """Handles the SECOND call in a two-call workflow."""
         print(f"Processing follow-up action: {follow_up_action} for session: {session_id}")
 
-        try:
-            # Convert email data to string format
-            email_content_str = json.dumps(email_data, indent=2)
-
-            if follow_up_action == "SUMMARIZE_CONTENT":
-                prompt = SUMMARIZER_PROMPT.format(
-                    original_command=original_command,
-                    email_content=email_content_str
-                )
-
-                response_text = self._call_together_ai(prompt, max_tokens=1500, temperature=0.3)
-
-                final_response = {
-                    "status": "success",
-                    "action_type": "FINAL_RESPONSE",
-                    "payload": {
-                        "text_response": response_text,
-                        "response_type": "summary",
-                        "processed_emails": len(email_data)
-                    }
-                }
-
-            elif follow_up_action == "ANSWER_QUESTION":
-                prompt = QUESTION_ANSWERER_PROMPT.format(
-                    original_command=original_command,
-                    email_content=email_content_str
-                )
+        if follow_up_action not in FOLLOW_UP_ACTIONS:
+            return {"error": f"Unknown follow-up action: {follow_up_action}"}
+        render_prompt, max_tokens, temperature, response_type = FOLLOW_UP_ACTIONS[follow_up_action]
 
-                response_text = self._call_together_ai(prompt, max_tokens=1000, temperature=0.2)
+        try:
+            # Keep only what the prompt needs, then convert to string format
+            emails = _project_emails(email_data)
+            # Serialize in a worker thread so a large payload doesn't stall other requests
+            email_content_str = await asyncio.to_thread(_dumps, emails)
+            prompt = render_prompt(original_command, email_content_str)
 
-                final_response = {
-                    "status": "success",
-                    "action_type": "FINAL_RESPONSE",
-                    "payload": {
-                        "text_response": response_text,
-                        "response_type": "answer",
-                        "processed_emails": len(email_data)
-                    }
-                }
+            response_text = await self._call_together_ai(prompt, max_tokens=max_tokens, temperature=temperature)
 
-            else:
-                return {"error": f"Unknown follow-up action: {follow_up_action}"}
+            final_response = self._final_response(response_text, response_type, len(emails))
 
             # Update history with the final outcome
-            self._update_history(session_id, f"System: Processed {follow_up_action} for {len(email_data)} emails",
+            self._update_history(session_id, f"System: Processed {follow_up_action} for {len(emails)} emails",
                                  final_response)
 
             return final_response
@@ -179,6 +324,41 @@ class CairaAI_Engine:
             print(f"Error processing follow-up: {e}")
             return {"error": f"Failed to process follow-up: {str(e)}"}
 
+    async def process_follow_up_stream(self, session_id: str, follow_up_action: str, email_data: list,
+                                       original_command: str):
+        """Streams the text of the SECOND call; the completed response is added to the history."""
+        print(f"Streaming follow-up action: {follow_up_action} for session: {session_id}")
+
+        if follow_up_action not in FOLLOW_UP_ACTIONS:
+            raise ValueError(f"Unknown follow-up action: {follow_up_action}")
+        render_prompt, max_tokens, temperature, response_type = FOLLOW_UP_ACTIONS[follow_up_action]
+
+        emails = _project_emails(email_data)
+        email_content_str = await asyncio.to_thread(_dumps, emails)
+        prompt = render_prompt(original_command, email_content_str)
+
+        chunks = []
+        async for text in self._stream_together_ai(prompt, max_tokens=max_tokens, temperature=temperature):
+            chunks.append(text)
+            yield text
+
+        final_response = self._final_response("".join(chunks).strip(), response_type, len(emails))
+        self._update_history(session_id, f"System: Processed {follow_up_action} for {len(emails)} emails",
+                             final_response)
+
+    @staticmethod
+    def _final_response(text_response: str, response_type: str, processed_emails: int) -> dict:
+        """Builds the FINAL_RESPONSE returned at the end of a two-call workflow."""
+        return {
+            "status": "success",
+            "action_type": "FINAL_RESPONSE",
+            "payload": {
+                "text_response": text_response,
+                "response_type": response_type,
+                "processed_emails": processed_emails
+            }
+        }
+
     def get_model_info(self) -> dict:
         """Returns information about the current model configuration."""
         return {
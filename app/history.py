@@ -0,0 +1,74 @@
+"""
+Bounded per-session conversation history, compacted for the router prompt
+"""
+
+import os
+from collections import deque
+
+import orjson
+
+# StreamingLLM-style window: the first HISTORY_SINK_TURNS entries anchor the session,
+# the last HISTORY_RECENT_TURNS carry the current thread, and the middle is dropped.
+HISTORY_SINK_TURNS = int(os.environ.get("CAIRA_HISTORY_SINK", "2"))
+HISTORY_RECENT_TURNS = int(os.environ.get("CAIRA_HISTORY_RECENT", "8"))
+# Entries kept per session for the history API; the router prompt uses far fewer
+HISTORY_MAX_TURNS = int(os.environ.get("CAIRA_HISTORY_MAX", "100"))
+
+
+class Turn:
+    """A single history entry; slotted to keep per-turn memory small."""
+    __slots__ = ("role", "content")
+
+    def __init__(self, role: str, content):
+        self.role = role
+        self.content = content
+
+    def as_dict(self) -> dict:
+        """Returns the entry in its API/prompt shape, e.g. {"user": "..."}."""
+        return {self.role: self.content}
+
+
+def compact_history(turns: list, sink: int = HISTORY_SINK_TURNS, recent: int = HISTORY_RECENT_TURNS) -> list:
+    """Keeps the first `sink` and last `recent` entries of a history, dropping the middle."""
+    if len(turns) > sink + recent:
+        return turns[:sink] + turns[len(turns) - recent:]
+    return list(turns)
+
+
+class SessionHistory:
+    """
+    A session's history, bounded to max_turns entries: the first `sink` entries are
+    always kept, followed by the latest ones. The router prompt only sees
+    compact_history() of it, so its size stays bounded however long the session runs.
+    """
+    __slots__ = ("_sink_size", "_head", "_tail")
+
+    def __init__(self, max_turns: int = HISTORY_MAX_TURNS, sink: int = HISTORY_SINK_TURNS):
+        self._sink_size = sink
+        # (turn, serialized line) pairs; each entry is serialized once, when it arrives
+        self._head: list = []
+        # The deque drops the oldest non-sink entries once it is full
+        self._tail: deque = deque(maxlen=max(max_turns - sink, 0))
+
+    def __len__(self) -> int:
+        return len(self._head) + len(self._tail)
+
+    def append(self, *turns: Turn) -> None:
+        """Adds entries, filling the sink first."""
+        for turn in turns:
+            entry = (turn, orjson.dumps(turn.as_dict()).decode())
+            if len(self._head) < self._sink_size:
+                self._head.append(entry)
+            else:
+                self._tail.append(entry)
+
+    def _entries(self) -> list:
+        return self._head + list(self._tail)
+
+    def turns(self) -> list:
+        """Returns the kept entries, oldest first."""
+        return [turn for turn, _ in self._entries()]
+
+    def prompt_text(self) -> str:
+        """Returns compact_history() of the entries as one JSON object per line."""
+        return "\n".join(line for _, line in compact_history(self._entries()))
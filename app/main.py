@@ -1,8 +1,10 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from .schemas import AIRequest, FollowUpRequest, AIResponse, ConversationHistory, HealthStatus
 from .engine import CairaAI_Engine
 from dotenv import load_dotenv
+import orjson
 import os
 
 # Load environment variables
@@ -11,7 +13,8 @@ load_dotenv()
 app = FastAPI(
     title="Caira Unified AI Engine",
     description="A unified conversational AI assistant for Gmail operations with hybrid workflow support",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -31,6 +34,18 @@ except ValueError as e:
     ai_engine = None
 
 
+@app.on_event("startup")
+async def warm_up_ai_engine():
+    """Makes a minimal Together AI call so the first real request doesn't pay connection setup."""
+    if ai_engine is None:
+        return
+
+    try:
+        await ai_engine._call_together_ai("ping", max_tokens=1)
+    except Exception as e:
+        print(f"AI engine warm-up failed: {e}")
+
+
 @app.get("/")
 def read_root():
     """Root endpoint with API information."""
@@ -44,6 +59,7 @@ def read_root():
         "endpoints": {
             "command": "POST /command - Process initial user command",
             "follow-up": "POST /follow-up - Process follow-up with email data",
+            "follow-up-stream": "POST /follow-up/stream - Stream the follow-up response as server-sent events",
             "history": "GET /history/{session_id} - Get conversation history",
             "clear": "DELETE /history/{session_id} - Clear conversation history",
             "health": "GET /health - System health check",
@@ -53,7 +69,7 @@ def read_root():
 
 
 @app.post("/command", response_model=AIResponse)
-def process_initial_command_endpoint(request: AIRequest):
+async def process_initial_command_endpoint(request: AIRequest):
     """
     Endpoint for the user's initial command. This is the first call.
     Determines whether to use single-call or two-call workflow.
@@ -65,7 +81,7 @@ def process_initial_command_endpoint(request: AIRequest):
         )
 
     try:
-        response_data = ai_engine.process_initial_command(
+        response_data = await ai_engine.process_initial_command(
             session_id=request.session_id,
             command_text=request.command_text,
             email_context=request.email_context
@@ -74,14 +90,14 @@ def process_initial_command_endpoint(request: AIRequest):
         if "error" in response_data:
             raise HTTPException(status_code=500, detail=response_data["error"])
 
-        return AIResponse(**response_data)
+        return AIResponse.model_validate(response_data)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
 
 @app.post("/follow-up", response_model=AIResponse)
-def process_follow_up_endpoint(request: FollowUpRequest):
+async def process_follow_up_endpoint(request: FollowUpRequest):
     """
     Endpoint for the second call in a two-call workflow.
     Processes email data and provides final response.
@@ -90,7 +106,7 @@ def process_follow_up_endpoint(request: FollowUpRequest):
         raise HTTPException(status_code=500, detail="AI engine not initialized")
 
     try:
-        response_data = ai_engine.process_follow_up(
+        response_data = await ai_engine.process_follow_up(
             session_id=request.session_id,
             follow_up_action=request.follow_up_action,
             email_data=request.email_data,
@@ -100,12 +116,44 @@ def process_follow_up_endpoint(request: FollowUpRequest):
         if "error" in response_data:
             raise HTTPException(status_code=500, detail=response_data["error"])
 
-        return AIResponse(**response_data)
+        return AIResponse.model_validate(response_data)
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"An unexpected error occurred: {str(e)}")
 
 
+@app.post("/follow-up/stream")
+async def process_follow_up_stream_endpoint(request: FollowUpRequest):
+    """
+    Streaming variant of /follow-up.
+    Sends the summary/answer text as server-sent events while it is generated.
+    """
+    if ai_engine is None:
+        raise HTTPException(status_code=500, detail="AI engine not initialized")
+
+    async def event_stream():
+        try:
+            async for text in ai_engine.process_follow_up_stream(
+                session_id=request.session_id,
+                follow_up_action=request.follow_up_action,
+                email_data=request.email_data,
+                original_command=request.original_command
+            ):
+                # JSON-encode each chunk so newlines in the text can't break SSE framing
+                yield f"data: {orjson.dumps({'text': text}).decode()}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            print(f"Error streaming follow-up: {e}")
+            yield f"event: error\ndata: {orjson.dumps({'detail': str(e)}).decode()}\n\n"
+
+    # Disable caching and nginx response buffering so chunks reach the client as they are generated
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.get("/history/{session_id}", response_model=ConversationHistory)
 def get_conversation_history(session_id: str):
     """
@@ -1,4 +1,7 @@
 # Note: Today's date is July 8, 2025
+import re
+import sys
+
 COMMAND_CLASSIFIER_PROMPT = """You are an expert AI request processor for a Gmail assistant. Your job is to analyze the user's most recent command in the context of the conversation history and respond with a single JSON object containing the `action_type` and a `payload`.
 
 Today's date is July 8, 2025.
@@ -53,8 +56,10 @@ For other actions:
 
 **Your JSON Response:**"""
 
-# Master Router Prompt for unified workflow decision making
-MASTER_ROUTER_PROMPT = """You are an expert AI request router for a Gmail assistant. Analyze the user's latest command in the context of the conversation history to determine the correct workflow. Respond with a single JSON object containing the `action_type` and a `payload`.
+# Master Router Prompt for unified workflow decision making.
+# The static instructions go in the system message and must stay byte-identical
+# across calls so the provider can cache them; only the per-turn part is formatted.
+MASTER_ROUTER_SYSTEM_PROMPT = """You are an expert AI request router for a Gmail assistant. Analyze the user's latest command in the context of the conversation history to determine the correct workflow. Respond with a single JSON object containing the `action_type` and a `payload`.
 
 Today's date is July 8, 2025.
 
@@ -96,11 +101,9 @@ For other actions:
 1. Use conversation history to resolve pronouns and references
 2. If user says "summarize it" after a search, use FETCH_AND_SUMMARIZE with the previous search
 3. If user asks about "that email" or "those messages", reference the last query
-4. For follow-up modifications to drafts, use UPDATED_DRAFT
-
----
+4. For follow-up modifications to drafts, use UPDATED_DRAFT"""
 
-**Conversation History:**
+MASTER_ROUTER_PROMPT = """**Conversation History:**
 {conversation_history}
 
 ---
@@ -138,3 +141,40 @@ Email Content:
 Please provide a direct, accurate answer to the user's question based on the email content. If the information isn't available in the emails, clearly state that.
 
 Answer:"""
+
+
+# --- Pre-split templates ---
+# Each template is split on its placeholders once at import, so rendering is a
+# plain concatenation of interned static chunks instead of a str.format() parse.
+_PLACEHOLDER_RE = re.compile(r"\{(\w+)\}")
+
+
+def _split_template(template: str, *fields: str) -> tuple:
+    """Returns the static chunks around the given placeholders, in order."""
+    parts = _PLACEHOLDER_RE.split(template)
+    if tuple(parts[1::2]) != fields:
+        raise ValueError(f"Template placeholders {parts[1::2]} do not match {fields}")
+    return tuple(sys.intern(chunk) for chunk in parts[0::2])
+
+
+_MASTER_ROUTER_PARTS = _split_template(MASTER_ROUTER_PROMPT, "conversation_history", "user_command")
+_SUMMARIZER_PARTS = _split_template(SUMMARIZER_PROMPT, "original_command", "email_content")
+_QUESTION_ANSWERER_PARTS = _split_template(QUESTION_ANSWERER_PROMPT, "original_command", "email_content")
+
+
+def render_master_router(conversation_history: str, user_command: str) -> str:
+    """Equivalent to MASTER_ROUTER_PROMPT.format(...)."""
+    head, mid, tail = _MASTER_ROUTER_PARTS
+    return head + conversation_history + mid + user_command + tail
+
+
+def render_summarizer(original_command: str, email_content: str) -> str:
+    """Equivalent to SUMMARIZER_PROMPT.format(...)."""
+    head, mid, tail = _SUMMARIZER_PARTS
+    return head + original_command + mid + email_content + tail
+
+
+def render_question_answerer(original_command: str, email_content: str) -> str:
+    """Equivalent to QUESTION_ANSWERER_PROMPT.format(...)."""
+    head, mid, tail = _QUESTION_ANSWERER_PARTS
+    return head + original_command + mid + email_content + tail
@@ -1,15 +1,22 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict
 from typing import Dict, Any, Literal, List, Union
 
 # --- Model for Incoming Requests ---
+# Request models are immutable, drop unknown fields and cap string sizes
+REQUEST_MODEL_CONFIG = ConfigDict(extra="ignore", frozen=True, str_max_length=100_000)
+
 # A single, unified request model
 class AIRequest(BaseModel):
+    model_config = REQUEST_MODEL_CONFIG
+
     session_id: str
     command_text: str
     email_context: Dict[str, Any] | None = None
 
 # This model is for the second call in a two-call workflow
 class FollowUpRequest(BaseModel):
+    model_config = REQUEST_MODEL_CONFIG
+
     session_id: str
     follow_up_action: Literal["SUMMARIZE_CONTENT", "ANSWER_QUESTION"]
     email_data: List[Dict[str, Any]]
@@ -30,4 +37,4 @@ class ConversationHistory(BaseModel):
 class HealthStatus(BaseModel):
     status: str
     ai_engine_initialized: bool
-    model_info: Dict[str, str]
+    model_info: Dict[str, Any]
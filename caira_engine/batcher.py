@@ -0,0 +1,178 @@
+"""
+Caira AI Engine: Follow-up Batching
+Coalesces concurrent summarization / Q&A prompts into shared LLM calls
+"""
+
+import asyncio
+import logging
+import re
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+BATCH_INSTRUCTION = """You will receive {count} independent requests, each labeled "### textN:".
+Handle every request separately. Start each answer on a new line with the label of its request
+(for example "### text1:") and do not write anything outside the labeled answers.
+
+{requests}"""
+
+# Matches raw instruction markers left in a submitted prompt
+_INST_MARKER_RE = re.compile(r"<s>|\[/?INST\]")
+# Matches the "### textN:" labels in a batched response
+_LABEL_RE = re.compile(r"^\s*###\s*text(\d+):", re.MULTILINE)
+# Rough characters-per-token ratio for English prompts, used to estimate context use
+_CHARS_PER_TOKEN = 4
+
+
+class TruncatedCompletionError(Exception):
+    """Raised by a completion function when the reply was cut off at max_tokens"""
+
+
+class BatchScheduler:
+    """
+    Micro-batcher for follow-up prompts.
+    A prompt submitted while nothing else is in flight goes straight to the LLM.
+    Prompts arriving while calls are in flight are collected for up to
+    max_wait_ms (or max_batch_size prompts) and sent as one labeled prompt,
+    whose response is split back per caller.
+
+    A batch mixes prompts from unrelated sessions, so one user's emails share an
+    LLM call with another's. Answers are split back per caller, but a model that
+    mixes up labels can leak content across them, so callers should only enable
+    batching (max_batch_size > 1) where that is acceptable.
+
+    Merged calls pass allow_truncation=False to completion_fn, which should raise
+    TruncatedCompletionError when the reply hits max_tokens; the batch is then
+    retried as individual calls.
+
+    A batch whose merged prompt plus max_tokens per prompt would not fit in
+    context_tokens is sent as individual calls instead.
+    """
+
+    def __init__(self, completion_fn: Callable[..., Awaitable[str]], max_tokens: int, temperature: float,
+                 max_batch_size: int = 1, max_wait_ms: float = 50.0, context_tokens: int = 8192):
+        self._completion_fn = completion_fn
+        self.max_tokens = max_tokens
+        self.temperature = temperature
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.context_tokens = context_tokens
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._dispatches: Set[asyncio.Task] = set()
+        self._inflight = 0
+
+    async def submit(self, prompt: str) -> str:
+        """Complete a prompt, batching it with other concurrent prompts when possible"""
+        self._inflight += 1
+        try:
+            if self._inflight == 1 or self.max_batch_size <= 1:
+                return await self._complete_one(prompt)
+
+            future = asyncio.get_running_loop().create_future()
+            self._ensure_worker()
+            await self._queue.put((prompt, future))
+            return await future
+        finally:
+            self._inflight -= 1
+
+    async def _complete_one(self, prompt: str) -> str:
+        return await self._completion_fn(prompt, max_tokens=self.max_tokens, temperature=self.temperature)
+
+    def _ensure_worker(self) -> None:
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._collect())
+
+    async def _collect(self) -> None:
+        """Drain the queue into batches of up to max_batch_size prompts or max_wait seconds"""
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_wait
+
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Dispatch in the background so the next batch can start collecting
+            task = asyncio.create_task(self._dispatch(batch))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        if len(batch) == 1:
+            prompt, future = batch[0]
+            await self._resolve(future, self._complete_one(prompt))
+            return
+
+        merged_prompt = self._build_prompt([prompt for prompt, _ in batch])
+        max_tokens = self.max_tokens * len(batch)
+        if len(merged_prompt) // _CHARS_PER_TOKEN + max_tokens > self.context_tokens:
+            logger.info(f"Batch of {len(batch)} prompts exceeds the context window, sending individually")
+            await self._complete_each(batch)
+            return
+
+        logger.info(f"Dispatching batched follow-up call with {len(batch)} prompts")
+        try:
+            response_text = await self._completion_fn(
+                merged_prompt, max_tokens=max_tokens, temperature=self.temperature, allow_truncation=False
+            )
+            answers = self._split_response(response_text)
+        except Exception as e:
+            # A failed or truncated merged reply should not fail the whole batch
+            logger.warning(f"Batched follow-up call failed ({str(e)}), retrying prompts individually")
+            await self._complete_each(batch)
+            return
+
+        retries = []
+        for i, (prompt, future) in enumerate(batch, 1):
+            if future.done():
+                continue
+            if answers.get(i):
+                future.set_result(answers[i])
+            else:
+                # The model dropped or mangled this label; ask for it on its own
+                logger.warning(f"Batched response missing answer for text{i}, retrying individually")
+                retries.append(self._resolve(future, self._complete_one(prompt)))
+
+        if retries:
+            await asyncio.gather(*retries)
+
+    async def _complete_each(self, batch: List[Tuple[str, asyncio.Future]]) -> None:
+        await asyncio.gather(*(self._resolve(future, self._complete_one(prompt)) for prompt, future in batch))
+
+    @staticmethod
+    async def _resolve(future: asyncio.Future, completion: Awaitable[str]) -> None:
+        try:
+            result = await completion
+        except Exception as e:
+            if not future.done():
+                future.set_exception(e)
+        else:
+            if not future.done():
+                future.set_result(result)
+
+    @staticmethod
+    def _build_prompt(prompts: List[str]) -> str:
+        requests = "\n\n".join(
+            f"### text{i}:\n{_INST_MARKER_RE.sub('', prompt).strip()}"
+            for i, prompt in enumerate(prompts, 1)
+        )
+        return BATCH_INSTRUCTION.format(count=len(prompts), requests=requests)
+
+    @staticmethod
+    def _split_response(response_text: str) -> Dict[int, str]:
+        labels = list(_LABEL_RE.finditer(response_text))
+        answers = {}
+        for label, next_label in zip(labels, labels[1:] + [None]):
+            end = next_label.start() if next_label else len(response_text)
+            answers[int(label.group(1))] = response_text[label.end():end].strip()
+        return answers
@@ -3,18 +3,63 @@ Caira AI Engine: Core AI Logic (Together AI)
 The intelligent brain of the email assistant
 """
 
-import together
-import json
+import functools
+import httpx
+import orjson
 import logging
 import os
-from typing import Dict, List, Any, Optional
+import re
+import time
+from typing import AsyncIterator, Dict, List, Any, Optional
 from datetime import datetime
 
-from .prompts import PromptTemplates
+from .batcher import BatchScheduler, TruncatedCompletionError
+from .prompts import (
+    DEFAULT_SYSTEM_PROMPT,
+    MASTER_ROUTER_SYSTEM_PROMPT,
+    SUMMARIZATION_SYSTEM_PROMPT,
+    QUESTION_ANSWERING_SYSTEM_PROMPT,
+    get_master_router_prompt,
+    get_summarization_prompt,
+    get_question_answering_prompt,
+    get_gmail_query_builder_prompt
+)
 from .schemas import ActionType
+from .utils import GmailQueryFastPath
 
 logger = logging.getLogger(__name__)
 
+# Markdown code fence wrapped around a JSON reply, stripped in a single pass
+_FENCE_RE = re.compile(r"\A\s*```(?:json)?\s*|\s*```\s*\Z")
+
+# Workflow classification of router action types
+_ONE_CALL_ACTIONS = frozenset({ActionType.GMAIL_QUERY_GENERATED, ActionType.ACTION_REQUIRED})
+_TWO_CALL_ACTIONS = frozenset({ActionType.FETCH_AND_SUMMARIZE, ActionType.FETCH_AND_ANSWER})
+
+# Seconds a Together AI connection probe result is reused
+PROBE_TTL_SECONDS = 30
+
+# Keyword classifiers for the fallback path; word boundaries avoid matches like "showcase"
+_SEARCH_KEYWORDS_RE = re.compile(r"\b(?:show|find|search|list|get)\b")
+_SUMMARY_KEYWORDS_RE = re.compile(r"\b(?:summarize|summary|overview)\b")
+
+TOGETHER_BASE_URL = "https://api.together.xyz/v1"
+
+# Pooled keep-alive HTTP/2 clients shared by every engine instance in the process, per base URL
+_HTTP_CLIENTS: Dict[str, httpx.AsyncClient] = {}
+
+def _get_http_client(base_url: str) -> httpx.AsyncClient:
+    """Return the process-wide client for an OpenAI-compatible endpoint"""
+    client = _HTTP_CLIENTS.get(base_url)
+    if client is None or client.is_closed:
+        client = _HTTP_CLIENTS[base_url] = httpx.AsyncClient(
+            base_url=base_url,
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+            timeout=30.0
+        )
+    return client
+
 class CairaAI_Engine:
     """
     Core AI Engine implementing hybrid workflow model
@@ -24,65 +69,144 @@ class CairaAI_Engine:
 
     def __init__(self):
         """Initialize the AI Engine with Together AI"""
+        # Together AI by default; VLLM_BASE_URL points at a (self-hosted) vLLM OpenAI-compatible server
+        self.base_url = os.getenv("VLLM_BASE_URL", TOGETHER_BASE_URL)
+
         self.api_key = os.getenv("TOGETHER_API_KEY")
-        if not self.api_key:
+        if not self.api_key and self.base_url == TOGETHER_BASE_URL:
             raise ValueError("TOGETHER_API_KEY environment variable is required")
 
-        # Configure Together AI
-        together.api_key = self.api_key
-        self.client = together.Together(api_key=self.api_key)
+        # Configure the OpenAI-compatible REST API over the shared client
+        self.client = _get_http_client(self.base_url)
+        self._headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
 
         # Model configuration
         self.model_name = os.getenv("TOGETHER_MODEL", "mistralai/Mistral-7B-Instruct-v0.1")
 
-        # Initialize prompt templates
-        self.prompts = PromptTemplates()
-
-        logger.info(f"Caira AI Engine initialized with Together AI model: {self.model_name}")
+        # Last connection probe as (monotonic time, result)
+        self._last_probe = (0.0, False)
+
+        # Opt-in, as in the app: build plain Gmail searches locally instead of calling the LLM
+        self.fast_routing = os.getenv("CAIRA_FAST_ROUTING", "false").lower() == "true"
+        # Gmail query fast path counters, for hit rate logging
+        self._fast_query_hits = 0
+        self._fast_query_calls = 0
+
+        # Merging follow-up prompts puts different users' emails in one LLM call, so it is opt-in
+        followup_batch_size = int(os.getenv("CAIRA_FOLLOWUP_BATCH_SIZE", "1"))
+        self._summary_batcher = BatchScheduler(
+            functools.partial(self._generate_completion, system_prompt=SUMMARIZATION_SYSTEM_PROMPT),
+            max_tokens=1500, temperature=0.5, max_batch_size=followup_batch_size
+        )
+        self._answer_batcher = BatchScheduler(
+            functools.partial(self._generate_completion, system_prompt=QUESTION_ANSWERING_SYSTEM_PROMPT),
+            max_tokens=1000, temperature=0.4, max_batch_size=followup_batch_size
+        )
+
+        logger.info(f"Caira AI Engine initialized with model {self.model_name} at {self.base_url}")
+
+    async def _test_connection(self) -> bool:
+        """Test connection to Together AI API, reusing a recent result for PROBE_TTL_SECONDS"""
+        probed_at, connected = self._last_probe
+        if time.monotonic() - probed_at < PROBE_TTL_SECONDS:
+            return connected
 
-    def _test_connection(self) -> bool:
-        """Test connection to Together AI API"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[{"role": "user", "content": "Test connection - respond with 'OK'"}],
-                max_tokens=10,
-                temperature=0.1
-            )
-            return bool(response.choices[0].message.content)
+            content = await self._chat_completion({
+                "model": self.model_name,
+                "messages": [{"role": "user", "content": "Test connection - respond with 'OK'"}],
+                "max_tokens": 10,
+                "temperature": 0.1
+            })
+            connected = bool(content)
         except Exception as e:
             logger.error(f"Connection test failed: {str(e)}")
-            return False
-
-    def _generate_completion(self, prompt: str, max_tokens: int = 1000, temperature: float = 0.3) -> str:
+            connected = False
+
+        self._last_probe = (time.monotonic(), connected)
+        return connected
+
+    async def _chat_completion(self, payload: Dict[str, Any], allow_truncation: bool = True) -> str:
+        """POST a chat completion request and return the first choice's content"""
+        response = await self.client.post("/chat/completions", json=payload, headers=self._headers)
+        response.raise_for_status()
+        choice = orjson.loads(response.content)["choices"][0]
+        if not allow_truncation and choice.get("finish_reason") == "length":
+            raise TruncatedCompletionError(f"Completion hit max_tokens={payload['max_tokens']}")
+        return choice["message"]["content"]
+
+    def _completion_payload(self, prompt: str, max_tokens: int, temperature: float,
+                            system_prompt: str = DEFAULT_SYSTEM_PROMPT) -> Dict[str, Any]:
+        """Build the chat completion request body shared by the blocking and streaming calls"""
+        return {
+            "model": self.model_name,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system_prompt
+                },
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "top_p": 0.9,
+            "repetition_penalty": 1.0,  # Mistral works better with lower repetition penalty
+            "stop": ["</s>"]  # Mistral's stop token
+        }
+
+    async def _generate_completion(self, prompt: str, max_tokens: int = 1000, temperature: float = 0.3,
+                                   system_prompt: str = DEFAULT_SYSTEM_PROMPT, allow_truncation: bool = True) -> str:
         """Generate completion using Together AI with Mistral 7B"""
         try:
-            response = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=[
-                    {
-                        "role": "system",
-                        "content": "You are Caira, an intelligent email assistant AI. You are precise, helpful, and always follow instructions exactly."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                max_tokens=max_tokens,
-                temperature=temperature,
-                top_p=0.9,
-                repetition_penalty=1.0,  # Mistral works better with lower repetition penalty
-                stop=["</s>"]  # Mistral's stop token
+            content = await self._chat_completion(
+                self._completion_payload(prompt, max_tokens, temperature, system_prompt), allow_truncation
             )
 
-            return response.choices[0].message.content.strip()
+            return content.strip()
 
         except Exception as e:
             logger.error(f"Error generating completion: {str(e)}")
             raise
 
-    def process_request(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
+    async def _stream_completion(self, prompt: str, max_tokens: int = 1000, temperature: float = 0.3,
+                                 system_prompt: str = DEFAULT_SYSTEM_PROMPT) -> AsyncIterator[str]:
+        """Stream a completion from Together AI, yielding text deltas as they arrive"""
+        payload = self._completion_payload(prompt, max_tokens, temperature, system_prompt)
+        payload["stream"] = True
+
+        async with self.client.stream("POST", "/chat/completions", json=payload, headers=self._headers) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                # Server-sent events: "data: {...}" lines, terminated by "data: [DONE]"
+                if not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                # Usage-only chunks (e.g. the final one with stream_options) carry no choices
+                choices = orjson.loads(data).get("choices")
+                if not choices:
+                    continue
+                delta = choices[0].get("delta", {}).get("content")
+                if delta:
+                    yield delta
+
+    def _fast_gmail_query(self, command_text: str) -> Optional[str]:
+        """Build the Gmail query without the LLM when the command is a plain search"""
+        search_string = GmailQueryFastPath.build(command_text)
+
+        self._fast_query_calls += 1
+        if search_string is not None:
+            self._fast_query_hits += 1
+        logger.info(f"Gmail query fast path {'hit' if search_string is not None else 'miss'} "
+                    f"(hit rate {self._fast_query_hits}/{self._fast_query_calls})")
+
+        return search_string
+
+    async def process_request(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Main entry point for processing requests
         Determines if request is initial or follow-up
@@ -90,10 +214,10 @@ class CairaAI_Engine:
         try:
             if "follow_up_action" in request_data:
                 logger.info("Processing follow-up request")
-                return self._handle_follow_up_request(request_data)
+                return await self._handle_follow_up_request(request_data)
             else:
                 logger.info("Processing initial command")
-                return self._handle_initial_command(request_data)
+                return await self._handle_initial_command(request_data)
         except Exception as e:
             logger.error(f"Error in process_request: {str(e)}")
             return {
@@ -102,7 +226,7 @@ class CairaAI_Engine:
                 "payload": {"error": str(e)}
             }
 
-    def _handle_initial_command(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
+    async def _handle_initial_command(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Handle initial user command using Master Router
         This is the core intelligence that determines workflow
@@ -112,26 +236,41 @@ class CairaAI_Engine:
             user_profile = request_data.get("user_profile", {})
             email_context = request_data.get("email_context")
 
+            # Plain searches ("unread emails from john") don't need the Master Router
+            search_string = self._fast_gmail_query(command_text) if self.fast_routing else None
+            if search_string is not None:
+                return {
+                    "status": "success",
+                    "action_type": ActionType.GMAIL_QUERY_GENERATED,
+                    "payload": {
+                        "gmail_search_string": search_string,
+                        "explanation": "Generated via fast path"
+                    },
+                    "metadata": {
+                        "timestamp": datetime.now().isoformat(),
+                        "model": None,
+                        "workflow_type": "one-call"
+                    }
+                }
+
             # Generate master router prompt
-            prompt = self.prompts.get_master_router_prompt(
+            prompt = get_master_router_prompt(
                 command_text, user_profile, email_context
             )
 
             # Get AI response with lower temperature for more consistent JSON
-            response_text = self._generate_completion(prompt, max_tokens=500, temperature=0.1)
+            response_text = await self._generate_completion(
+                prompt, max_tokens=500, temperature=0.1, system_prompt=MASTER_ROUTER_SYSTEM_PROMPT
+            )
 
             logger.info(f"Master Router raw response: {response_text}")
 
             # Parse JSON response
             try:
                 # Clean up response text - remove any markdown formatting
-                clean_response = response_text.strip()
-                if clean_response.startswith("\`\`\`json"):
-                    clean_response = clean_response.replace("\`\`\`json", "").replace("\`\`\`", "").strip()
-                elif clean_response.startswith("\`\`\`"):
-                    clean_response = clean_response.replace("\`\`\`", "").strip()
+                clean_response = _FENCE_RE.sub("", response_text)
 
-                ai_decision = json.loads(clean_response)
+                ai_decision = orjson.loads(clean_response)
 
                 # Validate response structure
                 if "action_type" not in ai_decision or "payload" not in ai_decision:
@@ -147,10 +286,10 @@ class CairaAI_Engine:
 
                 return ai_decision
 
-            except json.JSONDecodeError as e:
+            except orjson.JSONDecodeError as e:
                 logger.error(f"Failed to parse AI response as JSON: {response_text}")
                 # Fallback: try to extract action from text
-                return self._fallback_command_processing(command_text, user_profile)
+                return await self._fallback_command_processing(command_text, user_profile)
 
         except Exception as e:
             logger.error(f"Error in _handle_initial_command: {str(e)}")
@@ -160,7 +299,7 @@ class CairaAI_Engine:
                 "payload": {"error": f"Initial command processing failed: {str(e)}"}
             }
 
-    def _handle_follow_up_request(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
+    async def _handle_follow_up_request(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
         """
         Handle follow-up requests (second call in two-call workflow)
         """
@@ -170,9 +309,9 @@ class CairaAI_Engine:
             original_command = request_data.get("original_command", "")
 
             if follow_up_action == "SUMMARIZE_CONTENT":
-                return self._summarize_email_content(email_data, original_command)
+                return await self._summarize_email_content(email_data, original_command)
             elif follow_up_action == "ANSWER_QUESTION":
-                return self._answer_email_question(email_data, original_command)
+                return await self._answer_email_question(email_data, original_command)
             else:
                 raise ValueError(f"Unknown follow-up action: {follow_up_action}")
 
@@ -184,13 +323,13 @@ class CairaAI_Engine:
                 "payload": {"error": f"Follow-up processing failed: {str(e)}"}
             }
 
-    def _summarize_email_content(self, email_data: List[Dict], original_command: str) -> Dict[str, Any]:
+    async def _summarize_email_content(self, email_data: List[Dict], original_command: str) -> Dict[str, Any]:
         """Summarize email content using specialized prompt"""
         try:
-            prompt = self.prompts.get_summarization_prompt(email_data, original_command)
+            prompt = get_summarization_prompt(email_data, original_command)
 
             # Use higher max_tokens for summaries and slightly higher temperature for more natural language
-            summary_text = self._generate_completion(prompt, max_tokens=1500, temperature=0.5)
+            summary_text = await self._summary_batcher.submit(prompt)
 
             return {
                 "status": "success",
@@ -209,13 +348,13 @@ class CairaAI_Engine:
             logger.error(f"Error in _summarize_email_content: {str(e)}")
             raise
 
-    def _answer_email_question(self, email_data: List[Dict], original_command: str) -> Dict[str, Any]:
+    async def _answer_email_question(self, email_data: List[Dict], original_command: str) -> Dict[str, Any]:
         """Answer specific questions about email content"""
         try:
-            prompt = self.prompts.get_question_answering_prompt(email_data, original_command)
+            prompt = get_question_answering_prompt(email_data, original_command)
 
             # Use moderate settings for Q&A
-            answer_text = self._generate_completion(prompt, max_tokens=1000, temperature=0.4)
+            answer_text = await self._answer_batcher.submit(prompt)
 
             return {
                 "status": "success",
@@ -234,7 +373,24 @@ class CairaAI_Engine:
             logger.error(f"Error in _answer_email_question: {str(e)}")
             raise
 
-    def _fallback_command_processing(self, command_text: str, user_profile: Dict) -> Dict[str, Any]:
+    async def stream_email_summary(self, email_data: List[Dict], original_command: str) -> AsyncIterator[str]:
+        """Streaming variant of _summarize_email_content; yields the summary text as it is generated"""
+        prompt = get_summarization_prompt(email_data, original_command)
+
+        # Streamed prompts go straight to the LLM; batching needs the full response to split it
+        async for text in self._stream_completion(prompt, max_tokens=1500, temperature=0.5,
+                                                 system_prompt=SUMMARIZATION_SYSTEM_PROMPT):
+            yield text
+
+    async def stream_email_answer(self, email_data: List[Dict], original_command: str) -> AsyncIterator[str]:
+        """Streaming variant of _answer_email_question; yields the answer text as it is generated"""
+        prompt = get_question_answering_prompt(email_data, original_command)
+
+        async for text in self._stream_completion(prompt, max_tokens=1000, temperature=0.4,
+                                                 system_prompt=QUESTION_ANSWERING_SYSTEM_PROMPT):
+            yield text
+
+    async def _fallback_command_processing(self, command_text: str, user_profile: Dict) -> Dict[str, Any]:
         """
         Fallback processing when JSON parsing fails
         Uses simpler heuristics to determine action
@@ -244,11 +400,11 @@ class CairaAI_Engine:
         command_lower = command_text.lower()
 
         # Simple keyword-based classification
-        if any(word in command_lower for word in ["show", "find", "search", "list", "get"]):
+        if _SEARCH_KEYWORDS_RE.search(command_lower):
             # Likely a search query
-            query_prompt = self.prompts.get_gmail_query_builder_prompt(command_text)
+            query_prompt = get_gmail_query_builder_prompt(command_text)
             try:
-                search_string = self._generate_completion(query_prompt, max_tokens=200, temperature=0.1)
+                search_string = await self._generate_completion(query_prompt, max_tokens=200, temperature=0.1)
 
                 return {
                     "status": "success",
@@ -269,7 +425,7 @@ class CairaAI_Engine:
                     }
                 }
 
-        elif any(word in command_lower for word in ["summarize", "summary", "overview"]):
+        elif _SUMMARY_KEYWORDS_RE.search(command_lower):
             # Likely needs summarization
             return {
                 "status": "success",
@@ -289,21 +445,18 @@ class CairaAI_Engine:
                 }
             }
 
+    async def aclose(self) -> None:
+        """Close the pooled HTTP client; call once on application shutdown"""
+        await self.client.aclose()
+
     def _get_workflow_type(self, action_type: str) -> str:
         """Determine workflow type based on action_type"""
-        one_call_actions = [
-            ActionType.GMAIL_QUERY_GENERATED,
-            ActionType.ACTION_REQUIRED
-        ]
-
-        two_call_actions = [
-            ActionType.FETCH_AND_SUMMARIZE,
-            ActionType.FETCH_AND_ANSWER
-        ]
-
-        if action_type in one_call_actions:
+        if action_type in _ONE_CALL_ACTIONS:
             return "one-call"
-        elif action_type in two_call_actions:
+        elif action_type in _TWO_CALL_ACTIONS:
             return "two-call"
         else:
             return "unknown"
+
+# Name exported by the package
+CairaAIEngine = CairaAI_Engine
@@ -3,11 +3,13 @@ Caira AI Engine: FastAPI Server
 Main entry point for the AI Engine service
 """
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse, StreamingResponse
 import logging
-from typing import Dict, Any
+from typing import AsyncIterator, Dict, Any, List
 import os
+import orjson
 from dotenv import load_dotenv
 
 from .engine import CairaAI_Engine
@@ -24,7 +26,8 @@ logger = logging.getLogger(__name__)
 app = FastAPI(
     title="Caira AI Engine",
     description="Intelligent email assistant AI engine with hybrid workflow",
-    version="2.0.0"
+    version="2.0.0",
+    default_response_class=ORJSONResponse
 )
 
 # Add CORS middleware
@@ -39,6 +42,32 @@ app.add_middleware(
 # Initialize AI Engine
 ai_engine = CairaAI_Engine()
 
+@app.on_event("shutdown")
+async def close_ai_engine():
+    """Release the pooled Together AI connections"""
+    await ai_engine.aclose()
+
+# Email fields read by the summarization / Q&A prompts
+EMAIL_PROMPT_FIELDS = ("subject", "sender", "body")
+
+
+def _require_str(value: Any, name: str) -> str:
+    """Reject non-string values the way the validated endpoints' str fields would"""
+    if not isinstance(value, str):
+        raise TypeError(f"{name} must be a string, got {type(value).__name__}")
+    return value
+
+
+def _project_emails(email_data: Any) -> List[Dict[str, str]]:
+    """Keep only the prompt fields of each email, as strings"""
+    if not isinstance(email_data, list) or not all(isinstance(email, dict) for email in email_data):
+        raise TypeError("email_data must be a list of objects")
+    # The prompt renderers are lru_cached on these fields, so they must be hashable strings
+    return [
+        {field: _require_str(email[field], f"email_data.{field}") for field in EMAIL_PROMPT_FIELDS if field in email}
+        for email in email_data
+    ]
+
 
 @app.get("/")
 async def root():
@@ -53,10 +82,21 @@ async def root():
 
 @app.get("/health")
 async def health_check():
-    """Detailed health check"""
+    """Liveness check; does not call the LLM so probes stay cheap"""
+    return {
+        "status": "healthy",
+        "ai_engine": "initialized",
+        "model": "Together AI + Llama",
+        "timestamp": "2025-06-30T14:21:47Z"
+    }
+
+
+@app.get("/health/deep")
+async def deep_health_check():
+    """Detailed health check that probes Together AI (result cached briefly by the engine)"""
     try:
         # Test AI engine initialization
-        test_response = ai_engine._test_connection()
+        test_response = await ai_engine._test_connection()
         return {
             "status": "healthy",
             "ai_engine": "connected" if test_response else "disconnected",
@@ -81,7 +121,7 @@ async def process_request(request: InitialRequest | FollowUpRequest):
         request_data = request.model_dump()
 
         # Process through AI engine
-        response = ai_engine.process_request(request_data)
+        response = await ai_engine.process_request(request_data)
 
         logger.info(f"Generated response with action_type: {response.get('action_type')}")
         return response
@@ -103,7 +143,7 @@ async def process_follow_up(request: FollowUpRequest):
         logger.info("Processing follow-up request")
 
         request_data = request.model_dump()
-        response = ai_engine._handle_follow_up_request(request_data)
+        response = await ai_engine._handle_follow_up_request(request_data)
 
         logger.info("Follow-up request processed successfully")
         return response
@@ -116,6 +156,82 @@ async def process_follow_up(request: FollowUpRequest):
         )
 
 
+@app.post("/api/v1/ai-engine/follow-up/raw", response_model=AIResponse)
+async def process_follow_up_raw(request: Request):
+    """
+    Fast path for follow-up requests carrying large email_data payloads.
+    Parses the raw body once and keeps only the email fields the prompts
+    use, skipping Pydantic validation of the full mailbox dump.
+    """
+    try:
+        body = orjson.loads(await request.body())
+        request_data = {
+            "follow_up_action": _require_str(body["follow_up_action"], "follow_up_action"),
+            "original_command": _require_str(body["original_command"], "original_command"),
+            "email_data": _project_emails(body["email_data"])
+        }
+    except (orjson.JSONDecodeError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=422, detail=f"Invalid follow-up request: {str(e)}")
+
+    try:
+        logger.info("Processing raw follow-up request")
+
+        response = await ai_engine._handle_follow_up_request(request_data)
+
+        logger.info("Raw follow-up request processed successfully")
+        return response
+
+    except Exception as e:
+        logger.error(f"Error processing raw follow-up request: {str(e)}")
+        raise HTTPException(
+            status_code=500,
+            detail=f"Follow-up processing error: {str(e)}"
+        )
+
+
+def _sse_response(chunks: AsyncIterator[str]) -> StreamingResponse:
+    """Wrap a text stream as server-sent events that proxies pass through unbuffered"""
+    async def event_stream():
+        try:
+            async for text in chunks:
+                # JSON-encode each chunk so newlines in the text can't break SSE framing
+                yield f"data: {orjson.dumps({'text': text}).decode()}\n\n"
+            yield "event: done\ndata: {}\n\n"
+        except Exception as e:
+            logger.error(f"Error streaming response: {str(e)}")
+            yield f"event: error\ndata: {orjson.dumps({'detail': str(e)}).decode()}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.post("/api/v1/ai-engine/summarize")
+async def stream_summary(request: FollowUpRequest):
+    """
+    Streaming summarization endpoint.
+    Sends the summary as server-sent events while it is generated.
+    """
+    logger.info("Streaming summarization request")
+
+    request_data = request.model_dump()
+    return _sse_response(ai_engine.stream_email_summary(request_data["email_data"], request_data["original_command"]))
+
+
+@app.post("/api/v1/ai-engine/answer")
+async def stream_answer(request: FollowUpRequest):
+    """
+    Streaming question-answering endpoint.
+    Sends the answer as server-sent events while it is generated.
+    """
+    logger.info("Streaming question answering request")
+
+    request_data = request.model_dump()
+    return _sse_response(ai_engine.stream_email_answer(request_data["email_data"], request_data["original_command"]))
+
+
 if __name__ == "__main__":
     import uvicorn
 
@@ -3,78 +3,43 @@ Caira AI Engine: Prompt Templates (Optimized for Llama Models)
 Centralized prompt management for different AI tasks
 """
 
-from typing import Dict, List, Any
-import json
+import re
+from functools import lru_cache
+from typing import Dict, List, Any, Optional, Tuple
 
-class PromptTemplates:
-    """Collection of prompt templates optimized for Llama models"""
-
-    @staticmethod
-    def get_master_router_prompt(command_text: str, user_profile: Dict, email_context: Dict = None) -> str:
-        """
-        Master Router Prompt: Optimized for Mistral 7B Instruct
-        """
-
-        context_info = ""
-        if email_context:
-            context_info = f"""
-Current Email Context:
-- Subject: {email_context.get('subject', 'N/A')}
-- Sender: {email_context.get('sender', 'N/A')}
-- Body Preview: {email_context.get('body', 'N/A')[:200]}...
-"""
+# Runs of whitespace (HTML-sourced bodies are full of them) collapse to one space
+_WS_RE = re.compile(r"\s+")
 
-        return f"""<s>[INST] You are the Caira AI Engine's Master Router. Analyze the user's email command and return ONLY a JSON response.
+# Generic system message for prompts without a dedicated one
+DEFAULT_SYSTEM_PROMPT = "You are Caira, an intelligent email assistant AI. You are precise, helpful, and always follow instructions exactly."
 
-User Profile:
-- Email: {user_profile.get('email', 'N/A')}
-- Timezone: {user_profile.get('timezone', 'UTC')}
-- Language: {user_profile.get('language', 'en')}
-
-{context_info}
-
-User Command: "{command_text}"
+# Invariant system messages. They are identical on every call, so backends with prefix caching
+# (Together, vLLM --enable-prefix-caching) reuse their KV cache; only the user message varies.
+MASTER_ROUTER_SYSTEM_PROMPT = """You are the Caira AI Engine's Master Router. Analyze the user's email command and return ONLY a JSON response.
 
 CLASSIFICATION RULES:
 
 1. GMAIL_QUERY_GENERATED (One-Call):
    - Search, find, show, list emails
-   - Example: "Show emails from John" → {{"action_type": "GMAIL_QUERY_GENERATED", "payload": {{"gmail_search_string": "from:john"}}}}
+   - Example: "Show emails from John" → {"action_type": "GMAIL_QUERY_GENERATED", "payload": {"gmail_search_string": "from:john"}}
 
 2. ACTION_REQUIRED (One-Call):
    - Direct actions: block, delete, archive
-   - Example: "Block sender X" → {{"action_type": "ACTION_REQUIRED", "payload": {{"action": "BLOCK_SENDER", "parameters": {{"email": "x@example.com"}}}}}}
+   - Example: "Block sender X" → {"action_type": "ACTION_REQUIRED", "payload": {"action": "BLOCK_SENDER", "parameters": {"email": "x@example.com"}}}
 
 3. FETCH_AND_SUMMARIZE (Two-Call):
    - Summaries, overviews
-   - Example: "Summarize HR emails" → {{"action_type": "FETCH_AND_SUMMARIZE", "payload": {{"gmail_search_string": "from:hr"}}}}
+   - Example: "Summarize HR emails" → {"action_type": "FETCH_AND_SUMMARIZE", "payload": {"gmail_search_string": "from:hr"}}
 
 4. FETCH_AND_ANSWER (Two-Call):
    - Specific questions about content
-   - Example: "What time is the meeting?" → {{"action_type": "FETCH_AND_ANSWER", "payload": {{"gmail_search_string": "meeting"}}}}
+   - Example: "What time is the meeting?" → {"action_type": "FETCH_AND_ANSWER", "payload": {"gmail_search_string": "meeting"}}
 
 Current date: 2025-06-30
 
-Respond with ONLY valid JSON: [/INST]"""
+Respond with ONLY valid JSON."""
 
-    @staticmethod
-    def get_summarization_prompt(email_data: List[Dict], original_command: str) -> str:
-        """Summarization prompt optimized for Mistral 7B"""
-
-        emails_text = ""
-        for i, email in enumerate(email_data, 1):
-            emails_text += f"""
-Email {i}:
-Subject: {email.get('subject', 'No Subject')}
-From: {email.get('sender', 'Unknown')}
-Content: {email.get('body', 'No content')[:1000]}
----
-"""
-
-        return f"""<s>[INST] You are Caira, an intelligent email assistant. The user requested: "{original_command}"
-
-Here are the emails to summarize:
-{emails_text}
+SUMMARIZATION_SYSTEM_PROMPT = """You are Caira, an intelligent email assistant. Summarize the emails the user provides.
 
 Provide a clear summary focusing on:
 1. Key information and main points
@@ -82,34 +47,107 @@ Provide a clear summary focusing on:
 3. Action items or requests
 4. Overall themes
 
-Be conversational and helpful. [/INST]"""
+Be conversational and helpful."""
+
+QUESTION_ANSWERING_SYSTEM_PROMPT = """You are Caira, an intelligent email assistant. Answer the user's question based on the email content they provide.
 
-    @staticmethod
-    def get_question_answering_prompt(email_data: List[Dict], original_command: str) -> str:
-        """Question answering prompt optimized for Mistral 7B"""
+Be specific and quote relevant details when possible. If the information isn't available, say so honestly."""
 
-        emails_text = ""
-        for i, email in enumerate(email_data, 1):
-            emails_text += f"""
+@lru_cache(maxsize=1024)
+def _render_master_router(command_text: str, profile: Tuple, context: Optional[Tuple]) -> str:
+    email, timezone, language = profile
+
+    context_info = ""
+    if context:
+        subject, sender, body_preview = context
+        context_info = f"""
+Current Email Context:
+- Subject: {subject}
+- Sender: {sender}
+- Body Preview: {body_preview}...
+"""
+
+    return f"""User Profile:
+- Email: {email}
+- Timezone: {timezone}
+- Language: {language}
+
+{context_info}
+
+User Command: "{command_text}"
+"""
+
+def _render_emails(emails: Tuple) -> str:
+    return "".join(
+        f"""
 Email {i}:
-Subject: {email.get('subject', 'No Subject')}
-From: {email.get('sender', 'Unknown')}
-Content: {email.get('body', 'No content')[:1200]}
+Subject: {subject}
+From: {sender}
+Content: {body}
 ---
 """
+        for i, (subject, sender, body) in enumerate(emails, 1)
+    )
 
-        return f"""<s>[INST] You are Caira, an intelligent email assistant. The user asked: "{original_command}"
-
-Here are the relevant emails:
-{emails_text}
+@lru_cache(maxsize=1024)
+def _render_summarization(original_command: str, emails: Tuple) -> str:
+    return f"""The user requested: "{original_command}"
 
-Answer the user's question based on the email content. Be specific and quote relevant details when possible. If the information isn't available, say so honestly. [/INST]"""
+Here are the emails to summarize:
+{_render_emails(emails)}"""
 
-    @staticmethod
-    def get_gmail_query_builder_prompt(command_text: str) -> str:
-        """Gmail query builder optimized for Mistral 7B"""
+@lru_cache(maxsize=1024)
+def _render_question_answering(original_command: str, emails: Tuple) -> str:
+    return f"""The user asked: "{original_command}"
 
-        return f"""<s>[INST] Convert this request into a Gmail search query.
+Here are the relevant emails:
+{_render_emails(emails)}"""
+
+def _trim_body(body: str, max_chars: int) -> str:
+    """Truncate an email body and collapse its whitespace so it costs fewer prompt tokens"""
+    return _WS_RE.sub(' ', body[:max_chars]).strip()
+
+def _email_key(email_data: List[Dict], max_body_chars: int) -> Tuple:
+    """Hashable (subject, sender, body) tuples holding exactly what the prompts read"""
+    return tuple(
+        (email.get('subject', 'No Subject'), email.get('sender', 'Unknown'),
+         _trim_body(email.get('body', 'No content'), max_body_chars))
+        for email in email_data
+    )
+
+def get_master_router_prompt(command_text: str, user_profile: Dict, email_context: Dict = None) -> str:
+    """
+    Master Router user message, sent with MASTER_ROUTER_SYSTEM_PROMPT
+    Rendered prompts are cached on the fields they use (see _render_master_router)
+    """
+    profile = (
+        user_profile.get('email', 'N/A'),
+        user_profile.get('timezone', 'UTC'),
+        user_profile.get('language', 'en')
+    )
+
+    context = None
+    if email_context:
+        context = (
+            email_context.get('subject', 'N/A'),
+            email_context.get('sender', 'N/A'),
+            email_context.get('body', 'N/A')[:200]
+        )
+
+    return _render_master_router(command_text, profile, context)
+
+def get_summarization_prompt(email_data: List[Dict], original_command: str) -> str:
+    """Summarization user message, sent with SUMMARIZATION_SYSTEM_PROMPT"""
+    return _render_summarization(original_command, _email_key(email_data, 1000))
+
+def get_question_answering_prompt(email_data: List[Dict], original_command: str) -> str:
+    """Question answering user message, sent with QUESTION_ANSWERING_SYSTEM_PROMPT"""
+    return _render_question_answering(original_command, _email_key(email_data, 1200))
+
+def get_gmail_query_builder_prompt(command_text: str) -> str:
+    """Gmail query builder optimized for Mistral 7B"""
+
+    return f"""<s>[INST] Convert this request into a Gmail search query.
 
 Request: "{command_text}"
 
@@ -122,11 +160,10 @@ Examples:
 
 Respond with ONLY the search string: [/INST]"""
 
-    @staticmethod
-    def get_action_classifier_prompt(command_text: str) -> str:
-        """Prompt for classifying direct actions - optimized for Llama"""
+def get_action_classifier_prompt(command_text: str) -> str:
+    """Prompt for classifying direct actions - optimized for Llama"""
 
-        return f"""Classify this email management command and extract parameters.
+    return f"""Classify this email management command and extract parameters.
 
 Command: "{command_text}"
 
@@ -150,3 +187,19 @@ Respond with ONLY valid JSON in this format:
 {{"action": "ACTION_NAME", "parameters": {{"key": "value"}}}}
 
 Response:"""
+
+class PromptTemplates:
+    """
+    Collection of prompt templates optimized for Llama models
+    Backward-compatible namespace for the module-level prompt functions above;
+    hot paths import the functions directly
+    """
+
+PromptTemplates.get_master_router_prompt = staticmethod(get_master_router_prompt)
+PromptTemplates.get_summarization_prompt = staticmethod(get_summarization_prompt)
+PromptTemplates.get_question_answering_prompt = staticmethod(get_question_answering_prompt)
+PromptTemplates.get_gmail_query_builder_prompt = staticmethod(get_gmail_query_builder_prompt)
+PromptTemplates.get_action_classifier_prompt = staticmethod(get_action_classifier_prompt)
+
+# Name exported by the package
+PromptManager = PromptTemplates
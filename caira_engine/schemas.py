@@ -3,7 +3,7 @@ Caira AI Engine: Data Schemas
 Pydantic models for request/response validation
 """
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 from typing import Optional, List, Dict, Any, Union
 from enum import Enum
 
@@ -20,7 +20,7 @@ class UserProfile(BaseModel):
     """User profile information"""
     user_id: str
     email: str
-    preferences: Optional[Dict[str, Any]] = {}
+    preferences: Optional[Dict[str, Any]] = Field(default_factory=dict)
     timezone: Optional[str] = "UTC"
     language: Optional[str] = "en"
 
@@ -39,16 +39,26 @@ class EmailData(BaseModel):
     body: str
     timestamp: Optional[str] = None
     thread_id: Optional[str] = None
-    labels: Optional[List[str]] = []
+    labels: Optional[List[str]] = Field(default_factory=list)
+
+# Request models are immutable, drop unknown fields and cap string sizes
+REQUEST_MODEL_CONFIG = ConfigDict(extra="ignore", frozen=True, str_max_length=100_000)
 
 class InitialRequest(BaseModel):
     """Schema for initial AI Engine requests"""
+    model_config = REQUEST_MODEL_CONFIG
+
     command_text: str = Field(..., description="User's natural language command")
     user_profile: UserProfile
     email_context: Optional[EmailContext] = None
 
+# Name exported by the package
+AIRequest = InitialRequest
+
 class FollowUpRequest(BaseModel):
     """Schema for follow-up AI Engine requests"""
+    model_config = REQUEST_MODEL_CONFIG
+
     follow_up_action: str = Field(..., description="Type of follow-up action")
     email_data: List[EmailData] = Field(..., description="Email content to process")
     original_command: str = Field(..., description="Original user command")
@@ -62,7 +72,7 @@ class GmailQueryPayload(BaseModel):
 class ActionRequiredPayload(BaseModel):
     """Payload for direct actions"""
     action: str
-    parameters: Dict[str, Any] = {}
+    parameters: Dict[str, Any] = Field(default_factory=dict)
     confirmation_required: bool = False
 
 class FetchPayload(BaseModel):
@@ -75,7 +85,7 @@ class FinalResponsePayload(BaseModel):
     """Payload for final responses"""
     text_response: str
     confidence: Optional[float] = None
-    sources: Optional[List[str]] = []
+    sources: Optional[List[str]] = Field(default_factory=list)
 
 class AIResponse(BaseModel):
     """Standard AI Engine response schema"""
@@ -88,7 +98,7 @@ class AIResponse(BaseModel):
         FinalResponsePayload,
         Dict[str, Any]
     ]
-    metadata: Optional[Dict[str, Any]] = {}
+    metadata: Optional[Dict[str, Any]] = Field(default_factory=dict)
 
 class ErrorResponse(BaseModel):
     """Error response schema"""
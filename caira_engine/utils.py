@@ -3,15 +3,38 @@ Helper functions and utilities for the Caira AI Engine
 """
 
 import re
-import json
 import time
+import asyncio
+import functools
+import orjson
 import logging
-from typing import Dict, Any, List, Optional, Union
+from typing import Dict, Any, List, Optional, Tuple, Type, Union
 from datetime import datetime, timedelta
 import hashlib
+import heapq
+from collections import deque
+
+try:
+    import re2  # Optional: google-re2's linear-time engine for bulk extraction
+except ImportError:
+    re2 = None
+
+try:
+    import httpx  # Optional: only needed to recognise its transport errors as transient
+except ImportError:
+    httpx = None
 
 logger = logging.getLogger(__name__)
 
+# Patterns compiled once at import and shared by the helpers below
+_QUOTES_RE = re.compile(r'["\']')
+_WORD_RE = re.compile(r'\b\w+\b')
+_WS_RE = re.compile(r'\s+')
+_NONWORD_RE = re.compile(r'[^\w\s@.-]')
+_JSON_BLOCK_RE = re.compile(r'\{.*\}', re.DOTALL)
+_TRAILING_COMMA_RE = re.compile(r',(\s*[}\]])')
+_UNQUOTED_KEY_RE = re.compile(r'(\w+):')
+
 class EmailPatternMatcher:
     """Utility class for matching email patterns and extracting information"""
 
@@ -19,81 +42,154 @@ class EmailPatternMatcher:
     FOLDER_REGEX = r'(?:into|to|in)\s+["\']?([^"\']+)["\']?'
     DATE_REGEX = r'\b(?:today|yesterday|last\s+week|this\s+week|last\s+\w+|\d{1,2}/\d{1,2}/\d{4})\b'
 
+    _EMAIL_RE = re.compile(EMAIL_REGEX, re.IGNORECASE)
+    _FOLDER_RE = re.compile(FOLDER_REGEX, re.IGNORECASE)
+    _DATE_RE = re.compile(DATE_REGEX, re.IGNORECASE)
+    # Bulk pattern; re2 takes inline flags rather than re's flag arguments
+    _EMAIL_BATCH_RE = re2.compile('(?i)' + EMAIL_REGEX) if re2 is not None else _EMAIL_RE
+
     @classmethod
     def extract_emails(cls, text: str) -> List[str]:
         """Extract email addresses from text"""
-        return re.findall(cls.EMAIL_REGEX, text, re.IGNORECASE)
+        return cls._EMAIL_RE.findall(text)
+
+    @classmethod
+    def extract_emails_batch(cls, texts: List[str]) -> List[List[str]]:
+        """Extract email addresses from many texts, using re2 when it is installed"""
+        findall = cls._EMAIL_BATCH_RE.findall
+        return [findall(text) for text in texts]
 
     @classmethod
     def extract_folders(cls, text: str) -> List[str]:
         """Extract folder/label names from text"""
-        matches = re.findall(cls.FOLDER_REGEX, text, re.IGNORECASE)
+        matches = cls._FOLDER_RE.findall(text)
         return [match.strip() for match in matches]
 
     @classmethod
     def extract_dates(cls, text: str) -> List[str]:
         """Extract date references from text"""
-        return re.findall(cls.DATE_REGEX, text, re.IGNORECASE)
+        return cls._DATE_RE.findall(text)
 
     @classmethod
     def clean_folder_name(cls, folder_name: str) -> str:
         """Clean and normalize folder names"""
         # Remove quotes and extra whitespace
-        cleaned = re.sub(r'["\']', '', folder_name).strip()
+        cleaned = _QUOTES_RE.sub('', folder_name).strip()
         # Capitalize first letter of each word
         return ' '.join(word.capitalize() for word in cleaned.split())
 
 class TextProcessor:
     """Text processing utilities"""
 
-    STOP_WORDS = {
+    STOP_WORDS = frozenset({
         'the', 'a', 'an', 'and', 'or', 'but', 'in', 'on', 'at', 'to', 'for',
         'of', 'with', 'by', 'from', 'into', 'sort', 'find', 'search', 'emails',
         'email', 'show', 'me', 'all', 'get', 'please', 'can', 'you', 'i', 'my'
-    }
+    })
 
     @classmethod
     def extract_keywords(cls, text: str, max_keywords: int = 5) -> List[str]:
         """Extract meaningful keywords from text"""
-        # Convert to lowercase and extract words
-        words = re.findall(r'\b\w+\b', text.lower())
-
-        # Filter out stop words and short words
-        keywords = [
-            word for word in words
+        # Filter out stop words and short words, then dedup preserving order
+        keywords = dict.fromkeys(
+            word for word in _WORD_RE.findall(text.lower())
             if word not in cls.STOP_WORDS and len(word) > 2
-        ]
-
-        # Remove duplicates while preserving order
-        unique_keywords = []
-        seen = set()
-        for keyword in keywords:
-            if keyword not in seen:
-                unique_keywords.append(keyword)
-                seen.add(keyword)
+        )
 
-        return unique_keywords[:max_keywords]
+        return list(keywords)[:max_keywords]
 
     @classmethod
     def normalize_text(cls, text: str) -> str:
         """Normalize text for processing"""
         # Remove extra whitespace
-        text = re.sub(r'\s+', ' ', text).strip()
+        text = _WS_RE.sub(' ', text).strip()
         # Remove special characters but keep basic punctuation
-        text = re.sub(r'[^\w\s@.-]', '', text)
+        text = _NONWORD_RE.sub('', text)
         return text
 
+class GmailQueryFastPath:
+    """
+    Builds Gmail queries for commands made only of regular patterns
+    (sender, recipient, subject, unread/starred, attachments, date windows).
+    Returns None when any part of the command is not understood, so the
+    caller can fall back to the LLM query builder.
+    """
+
+    # Dots only inside a value, so sentence punctuation is not captured ("from John.")
+    _VALUE = r'([\w@+-]+(?:\.[\w@+-]+)*)'
+    _ADDRESS = r'([\w+-]+(?:\.[\w+-]+)*@[\w-]+(?:\.[\w-]+)+)'
+    # Relative dates are matched before from/to so "from yesterday" is not a sender
+    _PATTERNS = [
+        (re.compile(r'\b(?:in\s+the\s+)?(?:last|past)\s+(\d+)\s+days?\b'), lambda m: f"newer_than:{m.group(1)}d"),
+        (re.compile(r'\b(?:from\s+)?(?:last|this|past)\s+week\b'), lambda m: "newer_than:7d"),
+        (re.compile(r'\b(?:from\s+)?(?:last|this|past)\s+month\b'), lambda m: "newer_than:1m"),
+        (re.compile(r'\b(?:from\s+)?today\b'), lambda m: f"after:{GmailQueryFastPath._day(0)}"),
+        (re.compile(r'\b(?:from\s+)?yesterday\b'),
+         lambda m: f"after:{GmailQueryFastPath._day(1)} before:{GmailQueryFastPath._day(0)}"),
+        (re.compile(r'\bafter\s+(\d{4}/\d{1,2}/\d{1,2})\b'), lambda m: f"after:{m.group(1)}"),
+        (re.compile(r'\bbefore\s+(\d{4}/\d{1,2}/\d{1,2})\b'), lambda m: f"before:{m.group(1)}"),
+        (re.compile(r'\b(?:with|having|that\s+have|has)\s+(?:an?\s+)?attachments?\b|\battachments?\b'),
+         lambda m: "has:attachment"),
+        (re.compile(r'\bunread\b'), lambda m: "is:unread"),
+        (re.compile(r'\bstarred\b'), lambda m: "is:starred"),
+        (re.compile(r'\b(?:about|regarding|with\s+subject|subject)\s+' + _VALUE), lambda m: f"subject:{m.group(1)}"),
+        (re.compile(r'\bfrom\s+' + _VALUE), lambda m: f"from:{m.group(1)}"),
+        # A bare "to" is too common ("emails to schedule"), so it needs "sent" or an address
+        (re.compile(r'\bsent\s+to\s+' + _VALUE + r'|\bto\s+' + _ADDRESS),
+         lambda m: f"to:{m.group(1) or m.group(2)}"),
+    ]
+
+    # Words that carry no query meaning once the patterns above are removed
+    FILLER_WORDS = frozenset({
+        'show', 'me', 'my', 'all', 'the', 'any', 'some', 'find', 'search', 'list', 'get',
+        'please', 'can', 'you', 'i', 'a', 'an', 'for', 'emails', 'email', 'mails', 'mail',
+        'messages', 'message', 'inbox', 'in', 'that', 'which', 'are', 'is', 'received', 'recent'
+    })
+    # Captured values that are really pronouns or glue words, not senders/recipients/subjects
+    _BAD_VALUES = frozenset({
+        'me', 'my', 'the', 'a', 'an', 'this', 'that', 'these', 'those', 'it', 'its', 'they', 'them',
+        'their', 'him', 'his', 'her', 'us', 'our', 'you', 'your'
+    })
+
+    @staticmethod
+    def _day(days_ago: int) -> str:
+        return (datetime.now() - timedelta(days=days_ago)).strftime('%Y/%m/%d')
+
+    @classmethod
+    def build(cls, command_text: str) -> Optional[str]:
+        """Return a Gmail query for command_text, or None if it needs the LLM"""
+        remaining = command_text.lower()
+        terms = []
+
+        for pattern, build_term in cls._PATTERNS:
+            for match in pattern.finditer(remaining):
+                if any(value in cls._BAD_VALUES for value in match.groups()):
+                    return None
+                terms.append(build_term(match))
+            remaining = pattern.sub(' ', remaining)
+
+        if not terms:
+            return None
+        if any(word not in cls.FILLER_WORDS for word in _WORD_RE.findall(remaining)):
+            return None
+
+        return ' '.join(terms)
+
 class CacheManager:
     """Simple in-memory cache for LLM responses"""
 
     def __init__(self, ttl_seconds: int = 300):
-        self.cache: Dict[str, Dict[str, Any]] = {}
+        self.cache: Dict[bytes, Dict[str, Any]] = {}
         self.ttl_seconds = ttl_seconds
+        # Min-heap of (expiry_ts, key); may hold stale entries for overwritten keys
+        self._expiry: List[Tuple[float, bytes]] = []
 
-    def _generate_key(self, prompt: str, model_config: Dict[str, Any]) -> str:
+    def _generate_key(self, prompt: str, model_config: Dict[str, Any]) -> bytes:
         """Generate cache key from prompt and model config"""
-        content = f"{prompt}_{json.dumps(model_config, sort_keys=True)}"
-        return hashlib.md5(content.encode()).hexdigest()
+        digest = hashlib.blake2b(orjson.dumps(model_config, option=orjson.OPT_SORT_KEYS), digest_size=16)
+        digest.update(b"\x1f")
+        digest.update(prompt.encode("utf-8"))
+        return digest.digest()
 
     def get(self, prompt: str, model_config: Dict[str, Any]) -> Optional[Dict[str, Any]]:
         """Get cached response if available and not expired"""
@@ -102,66 +198,80 @@ class CacheManager:
         if key in self.cache:
             cached_item = self.cache[key]
             if time.time() - cached_item['timestamp'] < self.ttl_seconds:
-                logger.debug(f"Cache hit for key: {key[:8]}...")
+                logger.debug(f"Cache hit for key: {key[:4].hex()}...")
                 return cached_item['response']
             else:
                 # Remove expired item
                 del self.cache[key]
-                logger.debug(f"Cache expired for key: {key[:8]}...")
+                logger.debug(f"Cache expired for key: {key[:4].hex()}...")
 
         return None
 
     def set(self, prompt: str, model_config: Dict[str, Any], response: Dict[str, Any]) -> None:
         """Cache response"""
         key = self._generate_key(prompt, model_config)
+        now = time.time()
         self.cache[key] = {
             'response': response,
-            'timestamp': time.time()
+            'timestamp': now
         }
-        logger.debug(f"Cached response for key: {key[:8]}...")
+        heapq.heappush(self._expiry, (now + self.ttl_seconds, key))
+        logger.debug(f"Cached response for key: {key[:4].hex()}...")
 
     def clear(self) -> None:
         """Clear all cached items"""
         self.cache.clear()
+        self._expiry.clear()
         logger.info("Cache cleared")
 
     def cleanup_expired(self) -> None:
         """Remove expired cache entries"""
         current_time = time.time()
-        expired_keys = [
-            key for key, item in self.cache.items()
-            if current_time - item['timestamp'] >= self.ttl_seconds
-        ]
-
-        for key in expired_keys:
-            del self.cache[key]
+        removed = 0
+
+        # Only the entries that actually expired are touched
+        while self._expiry and self._expiry[0][0] <= current_time:
+            _, key = heapq.heappop(self._expiry)
+            item = self.cache.get(key)
+            # Skip keys already evicted by get() or refreshed by a later set()
+            if item is not None and current_time - item['timestamp'] >= self.ttl_seconds:
+                del self.cache[key]
+                removed += 1
 
-        if expired_keys:
-            logger.info(f"Cleaned up {len(expired_keys)} expired cache entries")
+        if removed:
+            logger.info(f"Cleaned up {removed} expired cache entries")
 
 class PerformanceMonitor:
     """Monitor performance metrics"""
 
+    WINDOW_SIZE = 100  # Measurements kept per operation
+
     def __init__(self):
-        self.metrics: Dict[str, List[float]] = {}
+        self.metrics: Dict[str, deque] = {}
+        # Running sum of each operation's window, so averages are O(1)
+        self.sums: Dict[str, float] = {}
 
     def record_processing_time(self, operation: str, duration_ms: float) -> None:
         """Record processing time for an operation"""
-        if operation not in self.metrics:
-            self.metrics[operation] = []
+        times = self.metrics.get(operation)
+        if times is None:
+            # Keep only the last WINDOW_SIZE measurements
+            times = self.metrics[operation] = deque(maxlen=self.WINDOW_SIZE)
+            self.sums[operation] = 0.0
 
-        self.metrics[operation].append(duration_ms)
+        if len(times) == times.maxlen:
+            # The append below evicts the oldest measurement
+            self.sums[operation] -= times[0]
 
-        # Keep only last 100 measurements
-        if len(self.metrics[operation]) > 100:
-            self.metrics[operation] = self.metrics[operation][-100:]
+        times.append(duration_ms)
+        self.sums[operation] += duration_ms
 
     def get_average_time(self, operation: str) -> Optional[float]:
         """Get average processing time for an operation"""
         if operation not in self.metrics or not self.metrics[operation]:
             return None
 
-        return sum(self.metrics[operation]) / len(self.metrics[operation])
+        return self.sums[operation] / len(self.metrics[operation])
 
     def get_stats(self, operation: str) -> Optional[Dict[str, float]]:
         """Get detailed stats for an operation"""
@@ -171,28 +281,92 @@ class PerformanceMonitor:
         times = self.metrics[operation]
         return {
             'count': len(times),
-            'average': sum(times) / len(times),
+            'average': self.sums[operation] / len(times),
             'min': min(times),
             'max': max(times),
             'latest': times[-1]
         }
 
+def _find_json_object(text: str) -> Optional[str]:
+    """Return the first balanced top-level {...} in text, skipping braces inside strings"""
+    start = text.find('{')
+    if start == -1:
+        return None
+
+    # Jump between braces and quotes with str.find (memchr) instead of walking every character.
+    # Next position of each character, or len(text) once it no longer occurs.
+    end = len(text)
+    find = text.find
+    next_open, next_close, next_quote = start, find('}', start), find('"', start)
+    if next_close == -1:
+        return None
+    if next_quote == -1:
+        next_quote = end
+
+    depth = 0
+    pos = start
+    while True:
+        if next_open < pos:
+            next_open = find('{', pos)
+            if next_open == -1:
+                next_open = end
+        if next_close < pos:
+            next_close = find('}', pos)
+            if next_close == -1:
+                return None
+        if next_quote < pos:
+            next_quote = find('"', pos)
+            if next_quote == -1:
+                next_quote = end
+
+        if next_quote < next_open and next_quote < next_close:
+            # Skip the string: its end is the first quote not preceded by an odd run of backslashes
+            pos = next_quote + 1
+            while True:
+                quote = find('"', pos)
+                if quote == -1:
+                    return None
+                backslash = quote
+                while text[backslash - 1] == '\\':
+                    backslash -= 1
+                pos = quote + 1
+                if (quote - backslash) % 2 == 0:
+                    break
+        elif next_open < next_close:
+            depth += 1
+            pos = next_open + 1
+        else:
+            depth -= 1
+            pos = next_close + 1
+            if depth == 0:
+                return text[start:pos]
+
 class JSONValidator:
     """Validate and clean JSON responses from LLMs"""
 
     @staticmethod
     def extract_json_from_text(text: str) -> Optional[Dict[str, Any]]:
         """Extract JSON from text that might contain other content"""
-        # Try to find JSON block
-        json_match = re.search(r'\{.*\}', text, re.DOTALL)
-        if not json_match:
-            return None
-
-        json_str = json_match.group()
+        # Usual case: the widest brace span is the JSON reply itself, parsed without any scanning
+        start, end = text.find('{'), text.rfind('}')
+        if start != -1 and end > start:
+            try:
+                return orjson.loads(text[start:end + 1])
+            except orjson.JSONDecodeError:
+                pass
+
+        # Otherwise find the first balanced JSON object
+        json_str = _find_json_object(text)
+        if json_str is None:
+            # Unbalanced output: take the widest brace span and let repair try it
+            json_match = _JSON_BLOCK_RE.search(text)
+            if not json_match:
+                return None
+            json_str = json_match.group()
 
         try:
-            return json.loads(json_str)
-        except json.JSONDecodeError:
+            return orjson.loads(json_str)
+        except orjson.JSONDecodeError:
             # Try to fix common JSON issues
             return JSONValidator._attempt_json_repair(json_str)
 
@@ -204,16 +378,16 @@ class JSONValidator:
             repaired = json_str
 
             # Fix trailing commas
-            repaired = re.sub(r',(\s*[}\]])', r'\1', repaired)
+            repaired = _TRAILING_COMMA_RE.sub(r'\1', repaired)
 
             # Fix unquoted keys
-            repaired = re.sub(r'(\w+):', r'"\1":', repaired)
+            repaired = _UNQUOTED_KEY_RE.sub(r'"\1":', repaired)
 
             # Fix single quotes
             repaired = repaired.replace("'", '"')
 
-            return json.loads(repaired)
-        except json.JSONDecodeError:
+            return orjson.loads(repaired)
+        except orjson.JSONDecodeError:
             logger.warning(f"Failed to repair JSON: {json_str[:100]}...")
             return None
 
@@ -224,27 +398,37 @@ class JSONValidator:
 
 def timing_decorator(func):
     """Decorator to measure function execution time"""
+    @functools.wraps(func)
     def wrapper(*args, **kwargs):
-        start_time = time.time()
+        start_ns = time.perf_counter_ns()
         result = func(*args, **kwargs)
-        end_time = time.time()
 
-        duration_ms = (end_time - start_time) * 1000
-        logger.debug(f"{func.__name__} took {duration_ms:.2f}ms")
+        logger.debug("%s took %.2fms", func.__name__, (time.perf_counter_ns() - start_ns) / 1e6)
 
         return result
     return wrapper
 
-def retry_on_failure(max_retries: int = 3, delay: float = 1.0):
+# Failures worth retrying; anything else (KeyError, TypeError, ...) will not succeed on retry.
+# httpx.TransportError covers its connect/read/write errors and timeouts (httpx.TimeoutException)
+TRANSIENT_ERRORS: Tuple[Type[BaseException], ...] = (ConnectionError, TimeoutError)
+if asyncio.TimeoutError is not TimeoutError:
+    # Separate class before Python 3.11
+    TRANSIENT_ERRORS += (asyncio.TimeoutError,)
+if httpx is not None:
+    TRANSIENT_ERRORS += (httpx.TransportError,)
+
+def retry_on_failure(max_retries: int = 3, delay: float = 1.0,
+                     retry_on: Tuple[Type[BaseException], ...] = TRANSIENT_ERRORS):
     """Decorator to retry function on failure"""
     def decorator(func):
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
             last_exception = None
 
             for attempt in range(max_retries):
                 try:
                     return func(*args, **kwargs)
-                except Exception as e:
+                except retry_on as e:
                     last_exception = e
                     if attempt < max_retries - 1:
                         logger.warning(f"Attempt {attempt + 1} failed for {func.__name__}: {e}")
@@ -255,3 +439,26 @@ def retry_on_failure(max_retries: int = 3, delay: float = 1.0):
             raise last_exception
         return wrapper
     return decorator
+
+def aretry_on_failure(max_retries: int = 3, delay: float = 1.0,
+                      retry_on: Tuple[Type[BaseException], ...] = TRANSIENT_ERRORS):
+    """Async variant of retry_on_failure that backs off without blocking the event loop"""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            last_exception = None
+
+            for attempt in range(max_retries):
+                try:
+                    return await func(*args, **kwargs)
+                except retry_on as e:
+                    last_exception = e
+                    if attempt < max_retries - 1:
+                        logger.warning(f"Attempt {attempt + 1} failed for {func.__name__}: {e}")
+                        await asyncio.sleep(delay * (attempt + 1))
+                    else:
+                        logger.error(f"All {max_retries} attempts failed for {func.__name__}")
+
+            raise last_exception
+        return wrapper
+    return decorator
@@ -31,6 +31,13 @@ def main():
 TOGETHER_API_KEY={api_key}
 TOGETHER_MODEL=mistralai/Mistral-7B-Instruct-v0.1
 
+# Optional: self-hosted vLLM (OpenAI-compatible) endpoint used instead of Together AI
+# Launch: vllm serve mistralai/Mistral-7B-Instruct-v0.1 --port 8001 --enable-prefix-caching --max-num-seqs 256 --max-num-batched-tokens 8192
+# 4-bit AWQ weights move ~4x fewer bytes per token; set TOGETHER_MODEL to the served name:
+#   vllm serve TheBloke/Mistral-7B-Instruct-v0.1-AWQ --quantization awq --port 8001 --enable-prefix-caching
+#   TOGETHER_MODEL=TheBloke/Mistral-7B-Instruct-v0.1-AWQ
+# VLLM_BASE_URL=http://localhost:8001/v1
+
 # Optional: Logging Configuration
 LOG_LEVEL=INFO
 
@@ -6,20 +6,34 @@ Development server startup script
 import os
 import sys
 import uvicorn
+from dotenv import load_dotenv
 
 # Add the parent directory to the Python path
 sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
 
 if __name__ == "__main__":
+    # Pick up HOST/PORT/WORKERS/RELOAD from the .env written by setup_together.py
+    load_dotenv()
+    host = os.getenv("HOST", "0.0.0.0")
+    port = int(os.getenv("PORT", "8000"))
+    # Conversation history lives in process memory, so extra workers only suit
+    # deployments that pin sessions to a worker; reload (dev only) forces one worker
+    workers = int(os.getenv("WORKERS", "1"))
+    reload = os.getenv("RELOAD", "false").lower() == "true"
+
     print("🚀 Starting Caira AI Engine Server...")
-    print("📍 Server will be available at: http://localhost:8000")
-    print("📖 API Documentation: http://localhost:8000/docs")
-    print("🔍 Health Check: http://localhost:8000/health")
+    print(f"📍 Server will be available at: http://localhost:{port}")
+    print(f"📖 API Documentation: http://localhost:{port}/docs")
+    print(f"🔍 Health Check: http://localhost:{port}/health")
 
     uvicorn.run(
         "app.main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True,
+        host=host,
+        port=port,
+        workers=1 if reload else workers,
+        # "auto" uses uvloop/httptools when installed (uvicorn[standard]) and falls back otherwise, e.g. on Windows
+        loop="auto",
+        http="auto",
+        reload=reload,
         log_level="info"
     )
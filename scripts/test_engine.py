@@ -4,87 +4,190 @@ Test script for the Caira AI Engine API using Together AI's Mistral model
 Run this script to test the conversational flow
 """
 
-import requests
-import json
+import argparse
+import asyncio
+import httpx
+import orjson
 import time
 
 BASE_URL = "http://127.0.0.1:8000"
 SESSION_ID = "test-conversation-123"
 
-
-def test_api():
+JSON_HEADERS = {"content-type": "application/json"}
+
+# Request bodies serialized once at import instead of on every call
+DRAFT_COMMAND_BODY = orjson.dumps({
+    "session_id": SESSION_ID,
+    "command_text": "Write an email to Sarah about the project delay."
+})
+UPDATE_COMMAND_BODY = orjson.dumps({
+    "session_id": SESSION_ID,
+    "command_text": "Set the new timeline to March 6th."
+})
+SUMMARY_STREAM_BODY = orjson.dumps({
+    "session_id": SESSION_ID,
+    "follow_up_action": "SUMMARIZE_CONTENT",
+    "original_command": "Summarize the latest project updates.",
+    "email_data": [
+        {
+            "sender": "sarah@example.com",
+            "subject": "Project timeline",
+            "date": "2025-06-28",
+            "snippet": "The vendor delivery slipped, so the launch moves to March 6th."
+        },
+        {
+            "sender": "pm@example.com",
+            "subject": "Re: Project timeline",
+            "date": "2025-06-29",
+            "snippet": "Agreed. Please update the client and the QA schedule by Friday."
+        }
+    ]
+})
+
+
+def _pp(obj) -> str:
+    """Pretty-prints obj as indented JSON with sorted keys, for stable diffs of the output."""
+    return orjson.dumps(obj, option=orjson.OPT_INDENT_2 | orjson.OPT_SORT_KEYS).decode()
+
+
+async def _check_total_turns(client: httpx.AsyncClient, expected: int) -> bool:
+    """Checks that the session history holds the expected number of entries."""
+    response = await client.get(f"/history/{SESSION_ID}")
+    total_turns = orjson.loads(response.content).get("total_turns") if response.status_code == 200 else None
+    if total_turns != expected:
+        print(f"❌ Expected {expected} history entries, got {total_turns}")
+        return False
+    print(f"✅ History carries {total_turns} entries")
+    return True
+
+
+async def test_api(verbose: bool = False):
     print("🚀 Testing Caira AI Engine API with Together AI Mistral")
     print("=" * 60)
 
-    # Test health check first
-    print("\n🏥 Health Check")
-    health_response = requests.get(f"{BASE_URL}/health")
-    if health_response.status_code == 200:
-        health_data = health_response.json()
-        print(f"✅ Status: {health_data['status']}")
-        print(f"🤖 AI Engine: {'Initialized' if health_data['ai_engine_initialized'] else 'Not Initialized'}")
-    else:
-        print(f"❌ Health check failed: {health_response.status_code}")
-        return
-
-    # Test 1: Initial draft request
-    print("\n📝 Test 1: Initial Email Draft")
-    response1 = requests.post(f"{BASE_URL}/process", json={
-        "session_id": SESSION_ID,
-        "command_text": "Write an email to Sarah about the project delay."
-    })
-
-    if response1.status_code == 200:
-        result1 = response1.json()
-        print(f"✅ Status: {result1['status']}")
-        print(f"📧 Action: {result1['action_type']}")
-        print(f"📄 Payload: {json.dumps(result1['payload'], indent=2)}")
-    else:
-        print(f"❌ Error: {response1.status_code} - {response1.text}")
-        return
-
-    time.sleep(1)
-
-    # Test 2: Follow-up modification
-    print("\n🔄 Test 2: Update the Draft")
-    response2 = requests.post(f"{BASE_URL}/process", json={
-        "session_id": SESSION_ID,
-        "command_text": "Set the new timeline to March 6th."
-    })
-
-    if response2.status_code == 200:
-        result2 = response2.json()
-        print(f"✅ Status: {result2['status']}")
-        print(f"📧 Action: {result2['action_type']}")
-        print(f"📄 Payload: {json.dumps(result2['payload'], indent=2)}")
-    else:
-        print(f"❌ Error: {response2.status_code} - {response2.text}")
-        return
-
-    time.sleep(1)
-
-    # Test 3: Get conversation history
-    print("\n📚 Test 3: Conversation History")
-    response3 = requests.get(f"{BASE_URL}/history/{SESSION_ID}")
-
-    if response3.status_code == 200:
-        history = response3.json()
-        print(f"✅ Session: {history['session_id']}")
-        print(f"📊 Total turns: {history['total_turns']}")
-        print("📜 History:")
-        for i, turn in enumerate(history['history']):
-            print(f"  {i + 1}. {json.dumps(turn, indent=4)}")
-    else:
-        print(f"❌ Error: {response3.status_code} - {response3.text}")
-
-    print("\n🎉 Testing completed!")
+    # One pooled keep-alive (HTTP/2 when the server offers it) connection for every call
+    async with httpx.AsyncClient(base_url=BASE_URL, timeout=30, http2=True) as client:
+        # Test health check first
+        print("\n🏥 Health Check")
+        health_response = await client.get("/health")
+        if health_response.status_code == 200:
+            health_data = orjson.loads(health_response.content)
+            print(f"✅ Status: {health_data['status']}")
+            print(f"🤖 AI Engine: {'Initialized' if health_data['ai_engine_initialized'] else 'Not Initialized'}")
+        else:
+            print(f"❌ Health check failed: {health_response.status_code}")
+            return
+
+        # Start from an empty session so the turn counts below are deterministic
+        await client.delete(f"/history/{SESSION_ID}")
+
+        # Test 1: Initial draft request
+        print("\n📝 Test 1: Initial Email Draft")
+        response1 = await client.post("/command", content=DRAFT_COMMAND_BODY, headers=JSON_HEADERS)
+
+        if response1.status_code == 200:
+            result1 = orjson.loads(response1.content)
+            print(f"✅ Status: {result1['status']}")
+            print(f"📧 Action: {result1['action_type']}")
+            if verbose:
+                print(f"📄 Payload: {_pp(result1['payload'])}")
+        else:
+            print(f"❌ Error: {response1.status_code} - {response1.text}")
+            return
+
+        # Test 2 builds on turn 1, so confirm the server is carrying that state first
+        if not await _check_total_turns(client, 2):
+            return
+
+        # Test 2: Follow-up modification
+        print("\n🔄 Test 2: Update the Draft")
+        response2 = await client.post("/command", content=UPDATE_COMMAND_BODY, headers=JSON_HEADERS)
+
+        if response2.status_code == 200:
+            result2 = orjson.loads(response2.content)
+            print(f"✅ Status: {result2['status']}")
+            print(f"📧 Action: {result2['action_type']}")
+            if verbose:
+                print(f"📄 Payload: {_pp(result2['payload'])}")
+        else:
+            print(f"❌ Error: {response2.status_code} - {response2.text}")
+            return
+
+        # Test 3: Get conversation history; the closing health check is independent,
+        # so both are issued together (multiplexed over one connection on HTTP/2)
+        print("\n📚 Test 3: Conversation History")
+        response3, final_health = await asyncio.gather(
+            client.get(f"/history/{SESSION_ID}"),
+            client.get("/health")
+        )
+
+        if response3.status_code == 200:
+            history = orjson.loads(response3.content)
+            print(f"✅ Session: {history['session_id']}")
+            print(f"📊 Total turns: {history['total_turns']}")
+            if history['total_turns'] != 4:
+                print("❌ Expected 4 history entries (two user/AI exchanges)")
+                return
+            if verbose:
+                print("📜 History:")
+                for i, turn in enumerate(history['history']):
+                    print(f"  {i + 1}. {_pp(turn)}")
+        else:
+            print(f"❌ Error: {response3.status_code} - {response3.text}")
+
+        print("\n🏥 Final Health Check")
+        if final_health.status_code == 200:
+            print(f"✅ Status: {orjson.loads(final_health.content)['status']}")
+        else:
+            print(f"❌ Health check failed: {final_health.status_code}")
+
+        # Test 4: Streamed follow-up, timing the first token separately from the full response
+        print("\n🌊 Test 4: Streamed Summary")
+        start = time.perf_counter()
+        first_token = None
+        event = None
+        async with client.stream("POST", "/follow-up/stream", content=SUMMARY_STREAM_BODY,
+                                 headers=JSON_HEADERS) as response4:
+            if response4.status_code != 200:
+                await response4.aread()
+                print(f"❌ Error: {response4.status_code} - {response4.text}")
+                return
+            async for line in response4.aiter_lines():
+                if line.startswith("event:"):
+                    event = line[6:].strip()
+                elif line.startswith("data:"):
+                    data = orjson.loads(line[5:])
+                    if event == "error":
+                        print(f"❌ Stream error: {data.get('detail')}")
+                        return
+                    if event is None and data.get("text"):
+                        if first_token is None:
+                            first_token = time.perf_counter() - start
+                        if verbose:
+                            print(data["text"], end="", flush=True)
+                elif not line:
+                    event = None
+        total = time.perf_counter() - start
+
+        if verbose:
+            print()
+        if first_token is None:
+            print("❌ Stream finished without any text")
+            return
+        print(f"✅ TTFT: {first_token * 1000:.1f}ms, total: {total * 1000:.1f}ms")
+
+        print("\n🎉 Testing completed!")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Smoke-test a running Caira AI Engine server")
+    parser.add_argument("--verbose", action="store_true", help="pretty-print payloads and history")
+    args = parser.parse_args()
+
     try:
-        test_api()
-    except requests.exceptions.ConnectionError:
+        asyncio.run(test_api(verbose=args.verbose))
+    except httpx.ConnectError:
         print("❌ Connection Error: Make sure the server is running on http://127.0.0.1:8000")
-        print("   Run: uvicorn app.main:app --reload")
+        print("   Run: uvicorn app.main:app --loop uvloop --http httptools --reload")
     except Exception as e:
         print(f"❌ Unexpected error: {e}")